@@ -0,0 +1,44 @@
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+_state = threading.local()
+
+# Data of these apps is read right after it was written (logins, sessions, dash state)
+PRIMARY_ONLY_APPS = {"admin", "auth", "contenttypes", "sessions", "django_plotly_dash"}
+
+
+@contextmanager
+def use_primary():
+    """Send all reads inside the block to the primary, e.g. while loading data."""
+    previous = getattr(_state, "pinned", False)
+    _state.pinned = True
+    try:
+        yield
+    finally:
+        _state.pinned = previous
+
+
+class PrimaryReplicaRouter:
+    """Reads go to a random replica, writes and migrations to the primary ("default")."""
+
+    def replicas(self):
+        return [alias for alias in settings.DATABASES if alias != "default"]
+
+    def db_for_read(self, model, **hints):
+        replicas = self.replicas()
+        if not replicas or getattr(_state, "pinned", False) or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return "default"
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # All databases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
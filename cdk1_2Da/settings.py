@@ -13,6 +13,8 @@ https://docs.djangoproject.com/en/4.1/ref/settings/
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -52,6 +54,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "klimadaten.profiling.ProfilingMiddleware",
 ]
 
 ROOT_URLCONF = "cdk1_2Da.urls"
@@ -79,25 +82,48 @@ WSGI_APPLICATION = "cdk1_2Da.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
-    }
-}
+# Configured from the environment, without any variables the local SQLite file is used.
+# PostgreSQL example:
+#   DB_ENGINE=django.db.backends.postgresql DB_NAME=cdk1_2da_django DB_USER=delfin DB_PASSWORD=delfin
+#   DB_HOST=localhost DB_REPLICA_HOSTS=replica1.local,replica2.local
+# Replicas have to be streaming replicas of the primary, SQLite has none (a copied file would serve
+# stale cities, stations, aggregates and storms right after the loader commands wrote them).
+DB_ENGINE = os.environ.get("DB_ENGINE", "django.db.backends.sqlite3")
 
-"""
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.postgresql",
-        "NAME": "cdk1_2da_django",
-        "USER": "delfin",
-        "PASSWORD": "delfin",
-        "HOST": "localhost",
+
+def env_list(name):
+    return [value.strip() for value in os.environ.get(name, "").split(",") if value.strip()]
+
+
+def database(name=None, host=None):
+    config = {
+        "ENGINE": DB_ENGINE,
+        "NAME": name or os.environ.get("DB_NAME", BASE_DIR / "db.sqlite3"),
+        # Keep connections open between requests and check them before reuse
+        "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": True,
     }
-}
+    if DB_ENGINE != "django.db.backends.sqlite3":
+        config.update(
+            USER=os.environ.get("DB_USER", ""),
+            PASSWORD=os.environ.get("DB_PASSWORD", ""),
+            HOST=host or os.environ.get("DB_HOST", "localhost"),
+            PORT=os.environ.get("DB_PORT", ""),
+        )
+    return config
 
-"""
+
+DATABASES = {"default": database()}
+
+if DB_ENGINE == "django.db.backends.sqlite3" and (env_list("DB_REPLICA_HOSTS") or env_list("DB_REPLICA_NAMES")):
+    raise ImproperlyConfigured("SQLite cannot have read replicas, nothing would keep them in sync with the primary.")
+
+for number, replica in enumerate(env_list("DB_REPLICA_HOSTS"), start=1):
+    DATABASES[f"replica{number}"] = database(host=replica)
+    # Tests run against the primary only
+    DATABASES[f"replica{number}"]["TEST"] = {"MIRROR": "default"}
+
+DATABASE_ROUTERS = ["cdk1_2Da.routers.PrimaryReplicaRouter"]
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -156,6 +182,52 @@ PLOTLY_COMPONENTS = [
     "dpd_static_support",
 ]
 
+# Redis cache for rendered pages, template fragments and table versions, see klimadaten/page_cache.py.
+# Without a running Redis every lookup is a miss and the pages are rendered as before.
+# Raise VERSION after a deploy that changes templates to drop all cached pages at once.
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": os.environ.get("REDIS_URL", "redis://127.0.0.1:6379/1"),
+        "KEY_PREFIX": "cdk1_2da",
+        "VERSION": 1,
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "IGNORE_EXCEPTIONS": True,
+            "SOCKET_CONNECT_TIMEOUT": 1,  # seconds
+            "SOCKET_TIMEOUT": 1,  # seconds
+        },
+    }
+}
+
+# In-process cache for decoded Open-Meteo arrays, see klimadaten/array_cache.py
+KLIMADATEN_ARRAY_CACHE = {
+    "MAX_BYTES": 64 * 1024 * 1024,  # memory budget in bytes
+    "TTL": 24 * 60 * 60,  # seconds
+}
+
+# Requests to the Open-Meteo archive, see klimadaten/openmeteo.py
+KLIMADATEN_FETCH_POLICY = {
+    "DEADLINE": 8,  # seconds after which no new attempt is made, also the read timeout of each attempt
+    "FAILURE_THRESHOLD": 5,  # failed requests in a row until the circuit breaker opens
+    "RESET_TIMEOUT": 30,  # seconds until an open circuit breaker lets a trial request through
+    "RECENT_DAYS": 90,  # ranges ending within this many days still change
+    "RECENT_MAX_AGE": 6 * 60 * 60,  # seconds until a stored recent range is refreshed in the background
+    "REFRESH_WORKERS": 2,
+}
+
+# Profiles of single requests, taken for staff users with "X-Profile: 1" or "?profile=1".
+# See klimadaten/profiling.py, the profiles are listed in the admin.
+KLIMADATEN_PROFILING = {
+    "DIR": BASE_DIR / "klimadaten" / "data" / "profiles",
+    "MAX_BYTES": 100 * 1024 * 1024,  # oldest profiles are removed above this size ...
+    "MAX_FILES": 500,  # ... or number of files
+    "SESSION_SECONDS": 10 * 60,  # "?profile=1" profiles the requests of the session this long
+}
+
+# Open-Meteo archive, "manage.py openmeteo_standin" serves generated data in the same format for load tests
+OPEN_METEO_ARCHIVE_URL = os.environ.get("OPEN_METEO_ARCHIVE_URL", "https://archive-api.open-meteo.com/v1/archive")
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/4.1/howto/static-files/
 
@@ -163,6 +235,17 @@ STATIC_URL = "static/"
 MEDIA_URL = "media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "klimadaten", "data", "images")
 
+# Static file names carry a content hash after collectstatic (e.g. vendor/plotly/plotly.min.<hash>.js),
+# so the web server can serve STATIC_ROOT with a far future Cache-Control header.
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "cdk1_2Da.storage.ForgivingManifestStaticFilesStorage",
+    },
+}
+
 STATICFILES_LOCATION = "static"
 STATIC_ROOT = "static"
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -0,0 +1,18 @@
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+
+class ForgivingManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Fingerprinted static files (e.g. plotly.min.js -> plotly.min.<hash>.js).
+
+    Some third party CSS and JS files reference files they do not ship
+    (mostly source maps). Those references are left as they are instead of
+    failing collectstatic.
+    """
+
+    manifest_strict = False
+
+    def hashed_name(self, name, content=None, filename=None):
+        try:
+            return super().hashed_name(name, content, filename)
+        except ValueError:
+            return name
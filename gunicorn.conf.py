@@ -0,0 +1,8 @@
+# Read by gunicorn from the working directory, e.g. gunicorn cdk1_2Da.wsgi -w 4 --threads 8
+
+
+def post_worker_init(worker):
+    # The in-process caches are per worker, fill them once Django is loaded in it
+    from klimadaten import warmup
+
+    warmup.start()
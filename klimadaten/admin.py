@@ -1,4 +1,70 @@
 from django.contrib import admin
-from .models import City
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html
+
+from klimadaten import profiling
+from .models import City, ProfileRecord, StormEvent
 
 admin.site.register([City])
+
+
+@admin.register(StormEvent)
+class StormEventAdmin(admin.ModelAdmin):
+    list_display = ["start", "end", "duration_days", "footprint", "peak_gust", "peak_city"]
+    list_filter = ["start"]
+    ordering = ["-peak_gust"]
+
+
+@admin.register(ProfileRecord)
+class ProfileRecordAdmin(admin.ModelAdmin):
+    list_display = ["created", "user", "method", "path", "label", "status", "duration", "pandas", "plotly", "download"]
+    list_filter = ["created", "method", "status"]
+    search_fields = ["path", "label"]
+    readonly_fields = [
+        field.name for field in ProfileRecord._meta.fields if field.name != "top_functions"
+    ] + ["download", "top"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description="ms", ordering="duration_ms")
+    def duration(self, record):
+        return f"{record.duration_ms:.0f}"
+
+    @admin.display(description="pandas ms")
+    def pandas(self, record):
+        return f"{record.package_ms('pandas'):.0f}"
+
+    @admin.display(description="Plotly ms")
+    def plotly(self, record):
+        return f"{record.package_ms('plotly'):.0f}"
+
+    @admin.display(description="cProfile")
+    def download(self, record):
+        url = reverse("admin:klimadaten_profilerecord_download", args=[record.pk])
+        return format_html('<a href="{}">{}</a>', url, record.file)
+
+    @admin.display(description="top functions")
+    def top(self, record):
+        return format_html("<pre>{}</pre>", record.top_functions)
+
+    def get_urls(self):
+        return [
+            path(
+                "<int:pk>/download/",
+                self.admin_site.admin_view(self.download_view),
+                name="klimadaten_profilerecord_download",
+            ),
+        ] + super().get_urls()
+
+    def download_view(self, request, pk):
+        record = get_object_or_404(ProfileRecord, pk=pk)
+        try:
+            return FileResponse(open(profiling.profile_dir() / record.file, "rb"), as_attachment=True)
+        except FileNotFoundError:
+            raise Http404("The profile was removed from the profile directory")
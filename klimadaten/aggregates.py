@@ -0,0 +1,72 @@
+import math
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Avg, Count, Max, Min
+
+from klimadaten.models import CountryAggregate, Station
+
+AGGREGATES = {
+    "station_count": Count("staid"),
+    "elevation_min": Min("elevation"),
+    "elevation_max": Max("elevation"),
+    "elevation_mean": Avg("elevation"),
+    "lat_min": Min("lat"),
+    "lat_max": Max("lat"),
+    "lon_min": Min("lon"),
+    "lon_max": Max("lon"),
+    "lat_centroid": Avg("lat"),
+    "lon_centroid": Avg("lon"),
+}
+
+DECIMAL_PLACES = {
+    "elevation_mean": Decimal("0.01"),
+    "lat_centroid": Decimal("0.000001"),
+    "lon_centroid": Decimal("0.000001"),
+}
+
+
+def _rounded(values):
+    # Avg returns more decimal places than the fields hold
+    for field, quantum in DECIMAL_PLACES.items():
+        if values.get(field) is not None:
+            values[field] = Decimal(values[field]).quantize(quantum)
+    return values
+
+
+def refresh_all():
+    """Rebuild the aggregates of all countries with one grouped query."""
+    rows = Station.objects.values("country").annotate(**AGGREGATES).order_by()
+    with transaction.atomic():
+        CountryAggregate.objects.all().delete()
+        CountryAggregate.objects.bulk_create(CountryAggregate(**_rounded(row)) for row in rows)
+
+
+def refresh_country(country):
+    values = Station.objects.filter(country=country).aggregate(**AGGREGATES)
+    if not values["station_count"]:
+        CountryAggregate.objects.filter(country=country).delete()
+        return
+    CountryAggregate.objects.update_or_create(country=country, defaults=_rounded(values))
+
+
+def country_choices():
+    choices = [
+        (country, country)
+        for country in CountryAggregate.objects.order_by("country").values_list("country", flat=True)
+    ]
+    choices.insert(0, ("", "Select a Country"))
+    return choices
+
+
+def map_view(aggregate):
+    """Center and mapbox zoom level that fit the bounding box of a country."""
+    center = {"lat": float(aggregate.lat_centroid), "lon": float(aggregate.lon_centroid)}
+    span = max(
+        float(aggregate.lon_max - aggregate.lon_min),
+        # Latitude degrees are drawn larger on a web mercator map
+        float(aggregate.lat_max - aggregate.lat_min) * 1.5,
+        0.1,
+    )
+    zoom = max(min(math.log2(360 / span) - 0.5, 12), 1)
+    return center, zoom
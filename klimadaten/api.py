@@ -0,0 +1,134 @@
+import gzip
+import hashlib
+import json
+
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
+
+from klimadaten.models import City, Station, TableVersion
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+POINT_SETS = {
+    "cities": {
+        "model": City,
+        "table": "city",
+        "fields": ["id", "name", "country", "iso2", "lat", "lon"],
+    },
+    "stations": {
+        "model": Station,
+        "table": "station",
+        "fields": ["staid", "name", "country", "lat", "lon", "elevation"],
+    },
+}
+
+# Browsers and CDNs may reuse a point set this long before they revalidate it with the ETag
+POINTS_MAX_AGE = 60 * 60
+
+
+def accepted_encodings(accept_encoding):
+    """The q-value of every coding in an ``Accept-Encoding`` header, ``*`` stands for all others."""
+    qualities = {}
+    for part in accept_encoding.split(","):
+        coding, *parameters = (item.strip() for item in part.split(";"))
+        if not coding:
+            continue
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    return qualities
+
+
+def content_encoding(request):
+    """The accepted coding with the highest q-value, Brotli before gzip on a tie, ``None`` for identity."""
+    qualities = accepted_encodings(request.headers.get("Accept-Encoding", ""))
+    best, best_quality = None, 0
+    for coding in ["br", "gzip"] if brotli is not None else ["gzip"]:
+        quality = qualities.get(coding, qualities.get("*", 0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compressed_response(request, content, content_type):
+    """Compress ``content`` for the client.
+
+    Unlike GZipMiddleware this keeps the ETag strong, the encoding is part of
+    the ETag computed in ``points_etag``.
+    """
+    encoding = content_encoding(request)
+    if encoding == "br":
+        content = brotli.compress(content)
+    elif encoding == "gzip":
+        content = gzip.compress(content, mtime=0)
+    response = HttpResponse(content, content_type=content_type)
+    if encoding:
+        response["Content-Encoding"] = encoding
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+
+def parse_bbox(value):
+    """Parse ``west,south,east,north`` into floats."""
+    west, south, east, north = (float(part) for part in value.split(","))
+    if west > east or south > north:
+        raise ValueError("bbox must be west,south,east,north")
+    return west, south, east, north
+
+
+def points_etag(request, kind, bbox):
+    point_set = POINT_SETS[kind]
+    version = TableVersion.current(point_set["table"])
+    query = hashlib.md5(request.GET.urlencode().encode(), usedforsecurity=False).hexdigest()[:12]
+    return f"{kind}-v{version}-{query}-{content_encoding(request) or 'identity'}"
+
+
+@require_GET
+def points(request, kind):
+    """Coordinates of all cities or stations as columnar JSON.
+
+    Optional filters: ``country`` (case insensitive) and ``bbox=west,south,east,north``.
+    """
+    # Validated before the caching headers and the ETag are added, so errors are never cached
+    if kind not in POINT_SETS:
+        raise Http404(f"Unknown point set {kind}")
+    bbox = None
+    if request.GET.get("bbox"):
+        try:
+            bbox = parse_bbox(request.GET["bbox"])
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+    return points_response(request, kind, bbox)
+
+
+@cache_control(public=True, max_age=POINTS_MAX_AGE)
+@condition(etag_func=points_etag)
+def points_response(request, kind, bbox):
+    point_set = POINT_SETS[kind]
+    queryset = point_set["model"].objects.all()
+    if request.GET.get("country"):
+        queryset = queryset.filter(country__iexact=request.GET["country"])
+    if bbox:
+        west, south, east, north = bbox
+        queryset = queryset.filter(lon__gte=west, lon__lte=east, lat__gte=south, lat__lte=north)
+
+    rows = list(queryset.order_by("pk").values_list(*point_set["fields"]))
+    columns = list(zip(*rows)) or [()] * len(point_set["fields"])
+    data = {
+        field: [float(value) for value in column] if field in ("lat", "lon", "elevation") else list(column)
+        for field, column in zip(point_set["fields"], columns)
+    }
+    data["count"] = len(rows)
+    content = json.dumps(data, separators=(",", ":")).encode()
+    return compressed_response(request, content, "application/json")
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class KlimadatenConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "klimadaten"
+
+    def ready(self):
+        from klimadaten import signals  # noqa: F401
@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+CacheInfo = namedtuple(
+    "CacheInfo",
+    ["hits", "misses", "evictions", "expired", "entries", "currbytes", "maxbytes"],
+)
+
+
+class ArrayCache:
+    """In-process LRU cache for decoded NumPy arrays with a byte budget and TTL.
+
+    Values are tuples of arrays. They are stored read-only so that callers
+    cannot modify the cached data by accident.
+    """
+
+    def __init__(self, max_bytes, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, nbytes, arrays)
+        self._lock = threading.Lock()
+        self._currbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, nbytes, arrays = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self._currbytes -= nbytes
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return arrays
+
+    def set(self, key, arrays, ttl=None):
+        """Store ``arrays``, ``ttl`` overrides the default time to live of the cache."""
+        arrays = tuple(arrays)
+        for array in arrays:
+            array.flags.writeable = False
+        nbytes = sum(array.nbytes for array in arrays)
+        if nbytes > self.max_bytes:
+            # Never let a single entry flush the whole cache
+            return
+        ttl = ttl or self.ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._currbytes -= old[1]
+            self._entries[key] = (expires_at, nbytes, arrays)
+            self._currbytes += nbytes
+            while self._currbytes > self.max_bytes:
+                _, (_, evicted_bytes, _) = self._entries.popitem(last=False)
+                self._currbytes -= evicted_bytes
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._currbytes = 0
+
+    def cache_info(self):
+        with self._lock:
+            return CacheInfo(
+                self.hits,
+                self.misses,
+                self.evictions,
+                self.expired,
+                len(self._entries),
+                self._currbytes,
+                self.max_bytes,
+            )
@@ -0,0 +1,62 @@
+import threading
+import time
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Stop calling an unhealthy upstream for a while instead of waiting for every call to time out.
+
+    After ``failure_threshold`` failures in a row the circuit opens and
+    ``before_call`` raises ``CircuitOpen`` at once. After ``reset_timeout``
+    seconds a single trial call is let through (half open): its success
+    closes the circuit, its failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half open"
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def before_call(self):
+        with self._lock:
+            state = self._state()
+            if state == self.OPEN or (state == self.HALF_OPEN and self._trial_running):
+                retry_in = max(self.reset_timeout - (time.monotonic() - self._opened_at), 0)
+                raise CircuitOpen(f"Upstream unavailable, next try in {retry_in:.0f}s")
+            if state == self.HALF_OPEN:
+                self._trial_running = True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
@@ -0,0 +1,76 @@
+"""City list held in memory for the Dash callbacks.
+
+The browser only keeps the key of the table (``cities-v<version>``) and the
+id of the selected city. The callbacks look the rows up here instead of
+receiving the whole list as JSON with every request. A table is built once
+per process and version of the city table.
+"""
+import threading
+
+import numpy as np
+
+from klimadaten.models import City, TableVersion
+
+_tables = {}
+_lock = threading.Lock()
+
+
+class CityTable:
+    def __init__(self, version):
+        rows = list(City.objects.order_by("id").values_list("id", "name", "lat", "lon", "country", "iso2"))
+        self.key = f"cities-v{version}"
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.name = np.array([row[1] for row in rows], dtype=object)
+        self.lat = np.array([float(row[2]) for row in rows])
+        self.lon = np.array([float(row[3]) for row in rows])
+        # Decimals as stored, requests built from them hit the entries already in the Open-Meteo HTTP cache
+        self.stored_lat = np.array([row[2] for row in rows], dtype=object)
+        self.stored_lon = np.array([row[3] for row in rows], dtype=object)
+        self.country = np.array([row[4] for row in rows], dtype=object)
+        self.iso2 = np.array([row[5] for row in rows], dtype=object)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index(self, city_id):
+        """Row of ``city_id`` or ``None``."""
+        if city_id is None:
+            return None
+        row = int(np.searchsorted(self.ids, city_id))
+        if row == len(self.ids) or self.ids[row] != city_id:
+            return None
+        return row
+
+    def city(self, city_id, stored_coordinates=False):
+        """The city as dict like the ``selected_station`` used by the plots, ``None`` if unknown."""
+        row = self.index(city_id)
+        if row is None:
+            return None
+        return {
+            "id": int(self.ids[row]),
+            "name": self.name[row],
+            "lat": self.stored_lat[row] if stored_coordinates else float(self.lat[row]),
+            "lon": self.stored_lon[row] if stored_coordinates else float(self.lon[row]),
+            "country": self.country[row],
+            "iso2": self.iso2[row],
+        }
+
+
+def current():
+    """The table of the current city version, the previous one is dropped."""
+    version = TableVersion.current("city")
+    key = f"cities-v{version}"
+    table = _tables.get(key)
+    if table is None:
+        with _lock:
+            table = _tables.get(key)
+            if table is None:
+                table = CityTable(version)
+                _tables.clear()
+                _tables[key] = table
+    return table
+
+
+def get(key):
+    """The table a client refers to with ``key``, the current one if that is gone."""
+    return _tables.get(key) or current()
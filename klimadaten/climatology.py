@@ -0,0 +1,168 @@
+"""Per-city wind climatology, computed in batch from the series store.
+
+For a block of cities at once the daily series are stacked into one
+``(cities, days)`` array and reduced to
+
+* gust percentiles per calendar month,
+* annual maxima (years with too many missing days are left out),
+* Gumbel and GEV return levels, fitted to the annual maxima with L-moments.
+
+The results of all cities are saved as one ``.npz`` next to the series and
+kept in memory, so the dashboard only looks them up::
+
+    climatology/wind_gusts_10m_max.npz
+"""
+import warnings
+from datetime import date
+
+import numpy as np
+from scipy.special import gamma
+
+from klimadaten import openmeteo, series_store
+
+PERCENTILES = (50, 90, 95, 99)
+RETURN_PERIODS = (10, 20, 50, 100)
+DISTRIBUTIONS = ("gumbel", "gev")
+
+MIN_YEAR_COVERAGE = 0.9  # share of the days of a year needed for its maximum
+MIN_YEARS = 10  # annual maxima needed for a fit
+
+_climatology_cache = {}
+
+
+def climatology_path(variable=openmeteo.DAILY_VARIABLE):
+    return series_store.store_dir() / "climatology" / f"{variable}.npz"
+
+
+def calendar(start_year, end_year):
+    """Return the month of every day and the first day index and length of every year."""
+    days = np.arange(np.datetime64(f"{start_year}-01-01"), np.datetime64(f"{end_year + 1}-01-01"))
+    months = days.astype("datetime64[M]").astype(int) % 12 + 1
+    year_starts = np.arange(np.datetime64(f"{start_year}"), np.datetime64(f"{end_year + 2}"), dtype="datetime64[Y]")
+    year_starts = (year_starts.astype("datetime64[D]") - days[0]).astype(int)
+    return months, year_starts[:-1], np.diff(year_starts)
+
+
+def monthly_percentiles(block, months):
+    result = np.full((len(block), 12, len(PERCENTILES)), np.nan, dtype=np.float32)
+    with warnings.catch_warnings():
+        # Cities without any value in a month stay NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for month in range(1, 13):
+            result[:, month - 1] = np.nanpercentile(block[:, months == month], PERCENTILES, axis=1).T
+    return result
+
+
+def annual_maxima(block, year_starts, year_lengths):
+    maxima = np.fmax.reduceat(block, year_starts, axis=1)
+    coverage = np.add.reduceat(np.isfinite(block), year_starts, axis=1, dtype=np.int32) / year_lengths
+    maxima[coverage < MIN_YEAR_COVERAGE] = np.nan
+    return maxima
+
+
+def l_moments(maxima):
+    """Return ``(l1, l2, t3, n)`` of every row, NaN values are ignored."""
+    x = np.sort(maxima.astype(np.float64), axis=1)  # NaN sort last
+    n = np.isfinite(x).sum(axis=1)
+    rank = np.arange(x.shape[1])
+    x = np.where(rank < n[:, None], x, 0.0)
+    count = n[:, None].astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Unbiased probability weighted moments (Hosking 1990)
+        b0 = x.sum(axis=1) / n
+        b1 = (x * rank / (count - 1)).sum(axis=1) / n
+        b2 = (x * rank * (rank - 1) / ((count - 1) * (count - 2))).sum(axis=1) / n
+        l2 = 2 * b1 - b0
+        t3 = (6 * b2 - 6 * b1 + b0) / l2
+    return b0, l2, t3, n
+
+
+def gumbel_levels(l1, l2, periods=RETURN_PERIODS):
+    scale = l2 / np.log(2)
+    location = l1 - np.euler_gamma * scale
+    reduced = -np.log(-np.log(1 - 1 / np.asarray(periods, dtype=np.float64)))
+    return location[:, None] + scale[:, None] * reduced
+
+
+def gev_levels(l1, l2, t3, periods=RETURN_PERIODS):
+    # Shape k as in Hosking's approximation, scipy.stats.genextreme calls it c
+    c = 2 / (3 + t3) - np.log(2) / np.log(3)
+    k = 7.8590 * c + 2.9554 * c**2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = l2 * k / ((1 - 2.0 ** -k) * gamma(1 + k))
+        location = l1 - scale * (1 - gamma(1 + k)) / k
+        y = -np.log(1 - 1 / np.asarray(periods, dtype=np.float64))
+        levels = location[:, None] + scale[:, None] / k[:, None] * (1 - y ** k[:, None])
+    # A shape of almost zero is the Gumbel distribution
+    return np.where(np.abs(k)[:, None] < 1e-6, gumbel_levels(l1, l2, periods), levels)
+
+
+def return_levels(maxima, periods=RETURN_PERIODS):
+    """Return levels of shape ``(cities, distributions, periods)`` and the number of years used."""
+    l1, l2, t3, n = l_moments(maxima)
+    levels = np.stack([gumbel_levels(l1, l2, periods), gev_levels(l1, l2, t3, periods)], axis=1)
+    levels[n < MIN_YEARS] = np.nan
+    return levels.astype(np.float32), n
+
+
+def compute(city_ids, start_year, end_year, variable=openmeteo.DAILY_VARIABLE, batch_size=256):
+    """Compute the climatology of ``city_ids`` over the full years ``start_year`` to ``end_year``."""
+    months, year_starts, year_lengths = calendar(start_year, end_year)
+    city_ids = np.asarray(sorted(city_ids), dtype=np.int64)
+    years = end_year - start_year + 1
+    result = {
+        "city_ids": city_ids,
+        "years": np.arange(start_year, end_year + 1, dtype=np.int16),
+        "percentiles": np.asarray(PERCENTILES, dtype=np.float32),
+        "return_periods": np.asarray(RETURN_PERIODS, dtype=np.float32),
+        "monthly_percentiles": np.empty((len(city_ids), 12, len(PERCENTILES)), dtype=np.float32),
+        "annual_maxima": np.empty((len(city_ids), years), dtype=np.float32),
+        "return_levels": np.empty((len(city_ids), len(DISTRIBUTIONS), len(RETURN_PERIODS)), dtype=np.float32),
+        "fitted_years": np.empty(len(city_ids), dtype=np.int16),
+    }
+    # Only one block of cities is held in memory at a time
+    for first in range(0, len(city_ids), batch_size):
+        rows = slice(first, first + batch_size)
+        block = series_store.read_block(city_ids[rows], date(start_year, 1, 1), date(end_year, 12, 31), variable)
+        result["monthly_percentiles"][rows] = monthly_percentiles(block, months)
+        maxima = annual_maxima(block, year_starts, year_lengths)
+        result["annual_maxima"][rows] = maxima
+        result["return_levels"][rows], result["fitted_years"][rows] = return_levels(maxima)
+    return result
+
+
+def save(result, variable=openmeteo.DAILY_VARIABLE):
+    path = climatology_path(variable)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp.npz")
+    np.savez(tmp_path, **result)
+    tmp_path.replace(path)
+
+
+def load(variable=openmeteo.DAILY_VARIABLE):
+    """Return the saved climatology arrays or ``None``, reloaded only if the file changed."""
+    path = climatology_path(variable)
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    cached = _climatology_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with np.load(path) as data:
+        climatology = {name: data[name] for name in data.files}
+    _climatology_cache[path] = (mtime, climatology)
+    return climatology
+
+
+def return_level(city_id, period=50, distribution="gev", variable=openmeteo.DAILY_VARIABLE):
+    """Return ``(level, fitted_years)`` of one city, ``None`` if it has no climatology."""
+    climatology = load(variable)
+    if climatology is None:
+        return None
+    row = np.searchsorted(climatology["city_ids"], city_id)
+    if row == len(climatology["city_ids"]) or climatology["city_ids"][row] != city_id:
+        return None
+    column = int(np.flatnonzero(climatology["return_periods"] == period)[0])
+    level = climatology["return_levels"][row, DISTRIBUTIONS.index(distribution), column]
+    return float(level), int(climatology["fitted_years"][row])
@@ -0,0 +1,147 @@
+"""Daily series per country, aggregated from the city series.
+
+The cities of all countries are sorted by their ISO code, so each country is
+one contiguous block of rows and every statistic is a single grouped
+``reduceat`` over the ``(cities, days)`` array:
+
+* the number of cities with a value,
+* the mean and the maximum over the cities,
+* the number of cities above the lower bound of each Beaufort level (the
+  exceedance cube of shape ``(countries, levels, days)``). Like the city
+  charts it counts values strictly greater than the threshold.
+
+The result is saved as one ``.npz`` next to the series::
+
+    countries/wind_gusts_10m_max.npz
+"""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from klimadaten import openmeteo, series_store
+from klimadaten.models import City
+
+# Lower bound in km/h of every Beaufort level
+BEAUFORT_KMH = np.array([0, 1, 6, 12, 20, 29, 39, 50, 62, 75, 89, 103, 118], dtype=np.float32)
+
+_countries_cache = {}
+
+
+def countries_path(variable=openmeteo.DAILY_VARIABLE):
+    return series_store.store_dir() / "countries" / f"{variable}.npz"
+
+
+def beaufort_level(kmh):
+    return int(np.searchsorted(BEAUFORT_KMH, kmh, side="right")) - 1
+
+
+def group_cities(city_ids):
+    """Return the city ids sorted by country, the country codes and the first row of every country."""
+    cities = City.objects.filter(id__in=city_ids).order_by("iso2", "id").values_list("id", "iso2")
+    ids, codes = zip(*cities) if cities else ((), ())
+    countries, starts = np.unique(np.asarray(codes, dtype=str), return_index=True)
+    return np.asarray(ids, dtype=np.int64), countries, starts
+
+
+def aggregate_block(block, starts):
+    """Reduce a ``(cities, days)`` block to the statistics of each group of rows starting at ``starts``."""
+    finite = np.isfinite(block)
+    cities = np.add.reduceat(finite, starts, axis=0, dtype=np.uint16)
+    sums = np.add.reduceat(np.where(finite, block, 0), starts, axis=0, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = (sums / cities).astype(np.float32)
+    maximum = np.fmax.reduceat(block, starts, axis=0)
+
+    # Highest Beaufort level whose lower bound the value exceeds, -1 where it is missing or 0
+    levels = np.where(finite, np.searchsorted(BEAUFORT_KMH, np.nan_to_num(block), side="left") - 1, -1)
+    exceeding = np.empty((len(starts), len(BEAUFORT_KMH), block.shape[1]), dtype=np.uint16)
+    for level in range(len(BEAUFORT_KMH)):
+        exceeding[:, level] = np.add.reduceat(levels >= level, starts, axis=0, dtype=np.uint16)
+    return cities, mean, maximum, exceeding
+
+
+def build(start, end, variable=openmeteo.DAILY_VARIABLE, chunk_days=366):
+    """Aggregate all stored cities between ``start`` and ``end`` per country."""
+    city_ids, countries, starts = group_cities(series_store.stored_city_ids(variable))
+    days = (end - start).days + 1
+    result = {
+        "countries": countries,
+        "start": np.datetime64(start, "D"),
+        "cities": np.zeros((len(countries), days), dtype=np.uint16),
+        "mean": np.full((len(countries), days), np.nan, dtype=np.float32),
+        "max": np.full((len(countries), days), np.nan, dtype=np.float32),
+        "exceeding": np.zeros((len(countries), len(BEAUFORT_KMH), days), dtype=np.uint16),
+    }
+    if not len(city_ids):
+        return result
+    # All cities but only one block of days are held in memory at a time
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end)
+        columns = slice((chunk_start - start).days, (chunk_end - start).days + 1)
+        block = series_store.read_block(city_ids, chunk_start, chunk_end, variable)
+        (
+            result["cities"][:, columns],
+            result["mean"][:, columns],
+            result["max"][:, columns],
+            result["exceeding"][:, :, columns],
+        ) = aggregate_block(block, starts)
+        chunk_start = chunk_end + timedelta(days=1)
+    return result
+
+
+def save(result, variable=openmeteo.DAILY_VARIABLE):
+    path = countries_path(variable)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp.npz")
+    np.savez(tmp_path, **result)
+    tmp_path.replace(path)
+
+
+def load(variable=openmeteo.DAILY_VARIABLE):
+    """Return the saved country arrays or ``None``, reloaded only if the file changed."""
+    path = countries_path(variable)
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    cached = _countries_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with np.load(path) as data:
+        countries = {name: data[name] for name in data.files}
+    _countries_cache[path] = (mtime, countries)
+    return countries
+
+
+def read(iso2, start, end, variable=openmeteo.DAILY_VARIABLE):
+    """Return the daily series of one country as DataFrame, ``None`` if it was not aggregated.
+
+    Besides ``date``, ``cities``, ``mean`` and ``max`` there is one column
+    ``share_bf<level>`` per Beaufort level with the share of cities above its lower bound.
+    """
+    countries = load(variable)
+    if countries is None:
+        return None
+    row = np.searchsorted(countries["countries"], iso2)
+    if row == len(countries["countries"]) or countries["countries"][row] != iso2:
+        return None
+    first = max((np.datetime64(start, "D") - countries["start"]).astype(int), 0)
+    last = min((np.datetime64(end, "D") - countries["start"]).astype(int) + 1, countries["cities"].shape[1])
+    if first >= last:
+        return None
+    cities = countries["cities"][row, first:last]
+    df = pd.DataFrame(
+        {
+            "date": pd.date_range(countries["start"] + first, periods=last - first, freq="D"),
+            "cities": cities,
+            "mean": countries["mean"][row, first:last],
+            "max": countries["max"][row, first:last],
+        }
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares = countries["exceeding"][row, :, first:last] / cities
+    for level, share in enumerate(shares):
+        df[f"share_bf{level}"] = share.astype(np.float32)
+    return df
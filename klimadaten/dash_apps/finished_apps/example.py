@@ -1,63 +1,103 @@
-from dash import dcc, html
-from dash.dependencies import Input, Output
-from django_plotly_dash import DjangoDash
-from django.conf import settings
-import plotly.express as px
-import pandas as pd
-
-
-external_stylesheets = ["https://codepen.io/chriddyp/pen/bWLwgP.css"]
-
-
-def fetch_data():
-    file_path = settings.BASE_DIR / "klimadaten" / "data" / "wws19791205.csv"
-    data = pd.read_csv(file_path)
-    df = pd.DataFrame(data)
-    return df[df["FX"] > 25]
-
-
-app = DjangoDash("SimpleExample", external_stylesheets=external_stylesheets)
-
-app.layout = html.Div(
-    [
-        dcc.Dropdown(
-            id="year-picker",
-            options=[{"label": year, "value": year} for year in range(2000, 2023)],
-            value=2022,
-        ),
-        dcc.Dropdown(
-            id="month-picker",
-            options=[{"label": month, "value": month} for month in range(1, 13)],
-            value=1,
-        ),
-        dcc.Graph(id="wind-map"),
-    ]
-)
-
-
-@app.callback(
-    Output("wind-map", "figure"),
-    [Input("year-picker", "value"), Input("month-picker", "value")],
-)
-def update_map(selected_year, selected_month):
-    # For now, we ignore the year and month in the data filtering
-    # You would add filtering logic here based on the selected year and month
-    df = fetch_data()
-    fig = px.scatter_geo(
-        df,
-        lat="lat",
-        lon="lon",
-        color="FX",
-        hover_name="FX",
-        projection="natural earth",
-        title="Wind Speeds over Europe",
-        # height=300,
-    )
-    fig.update_geos(
-        visible=False,
-        projection_type="equirectangular",
-        fitbounds="locations",
-        showcountries=True,
-        countrycolor="RebeccaPurple",
-    )
-    return fig
+from dash import dcc, html
+from dash.dependencies import Input, Output
+from dash.exceptions import PreventUpdate
+from django_plotly_dash import DjangoDash
+import plotly.express as px
+import pandas as pd
+
+from klimadaten import grid_store
+
+external_stylesheets = ["https://codepen.io/chriddyp/pen/bWLwgP.css"]
+
+MIN_WINDSPEED = 25
+
+
+def fetch_data(selected_year, selected_month, selected_day=None):
+    # Only the selected days are memory-mapped, the maximum per grid point is taken over the month
+    df = grid_store.aggregate(selected_year, selected_month, selected_day, how="max")
+    return df[df[grid_store.DEFAULT_VARIABLE] > MIN_WINDSPEED]
+
+
+def available_years(available_days):
+    return sorted({day.year for day in available_days}) or list(range(2000, 2023))
+
+
+def year_options(available_days):
+    return [{"label": year, "value": year} for year in available_years(available_days)]
+
+
+# Only the initial selection is taken at import, the year options are read again on every page load
+available_days = grid_store.available_days()
+initial_day = available_days[-1] if available_days else None
+
+app = DjangoDash("SimpleExample", external_stylesheets=external_stylesheets)
+
+app.layout = html.Div(
+    [
+        dcc.Dropdown(
+            id="year-picker",
+            options=year_options(available_days),
+            value=initial_day.year if initial_day else available_years(available_days)[-1],
+        ),
+        dcc.Dropdown(
+            id="month-picker",
+            options=[{"label": month, "value": month} for month in range(1, 13)],
+            value=initial_day.month if initial_day else 1,
+        ),
+        dcc.Dropdown(
+            id="day-picker",
+            options=[{"label": day, "value": day} for day in range(1, 32)],
+            value=initial_day.day if initial_day else None,
+            placeholder="Ganzer Monat",
+        ),
+        dcc.Graph(id="wind-map"),
+    ]
+)
+
+
+@app.callback(
+    Output("year-picker", "options"),
+    [Input("year-picker", "search_value")],
+)
+def update_year_options(search_value):
+    # Days ingested by load_wind_data after the start show up without a restart, typing only filters
+    if search_value:
+        raise PreventUpdate
+    return year_options(grid_store.available_days())
+
+
+@app.callback(
+    Output("wind-map", "figure"),
+    [Input("year-picker", "value"), Input("month-picker", "value"), Input("day-picker", "value")],
+)
+def update_map(selected_year, selected_month, selected_day):
+    if selected_year is None or selected_month is None:
+        # A cleared picker keeps the last map
+        raise PreventUpdate
+    try:
+        df = fetch_data(selected_year, selected_month, selected_day)
+        period = f"{selected_year}-{selected_month:02d}"
+        if selected_day:
+            period += f"-{selected_day:02d}"
+    except ValueError:
+        # e.g. the 31st of a month with 30 days
+        df = pd.DataFrame(columns=["lat", "lon", grid_store.DEFAULT_VARIABLE])
+        period = "-"
+    fig = px.scatter_geo(
+        df,
+        lat="lat",
+        lon="lon",
+        color=grid_store.DEFAULT_VARIABLE,
+        hover_name=grid_store.DEFAULT_VARIABLE,
+        projection="natural earth",
+        title=f"Wind Speeds over Europe ({period})",
+        # height=300,
+    )
+    fig.update_geos(
+        visible=False,
+        projection_type="equirectangular",
+        fitbounds="locations",
+        showcountries=True,
+        countrycolor="RebeccaPurple",
+    )
+    return fig
@@ -1,14 +1,18 @@
-from datetime import timedelta, datetime
+from datetime import date, timedelta, datetime
+from types import SimpleNamespace
 
+import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 from django_plotly_dash import DjangoDash
-from klimadaten.models import City
+from klimadaten import city_table, climatology, country_series, figures, series_store
+from klimadaten.models import StormEvent
+from klimadaten.openmeteo import UpstreamUnavailable, call_open_meteo
+from klimadaten.page_cache import cached_call
+from klimadaten.profiling import profiled_callback
 import plotly.express as px
 import pandas as pd
-import openmeteo_requests
-import requests_cache
-from retry_requests import retry
 
 BEAUFORT_SCALE = {
     0: {'ms': 0, 'kmh': 0, 'name': "Windstille, Flaute"},
@@ -87,35 +91,38 @@ EUROPE_EAST = 60  # Ural Mountains in Russia
 app = DjangoDash("StationsMap")
 
 
-def fetch_data():
-    station_data = City.objects.all()
-    df = pd.DataFrame.from_records(station_data.values("name", "lat", "lon", "country", "iso2"))
-    return df
+# Storms listed in the dropdown, the ones with the largest footprint
+STORM_LIST_SIZE = 200
 
 
-# Initial data fetch
-station_data = fetch_data().to_dict('records')
+def storm_options():
+    # Found by "manage.py detect_storms"
+    storms = StormEvent.objects.select_related("peak_city").order_by("-footprint")[:STORM_LIST_SIZE]
+    return [
+        {
+            'label': f"{storm.start:%d.%m.%Y}, {storm.duration_days} Tage, {storm.footprint} Orte, "
+                     f"bis {storm.peak_gust:.0f} km/h",
+            'value': storm.id,
+        }
+        for storm in sorted(storms, key=lambda storm: storm.start, reverse=True)
+    ]
 
-# Initial selected station data
-initial_selected_station = {
-    "name": "Sumba",
-    "lat": 61.405500,
-    "lon": -6.709000,
-    "country": "Faroe Islands",
-    "iso2": "FO",
-}
+
+# Initially selected city: Sumba, Faroe Islands
+INITIAL_CITY_ID = 1234926212
 
 app.layout = html.Div(
     [
-        dcc.Store(id='station-data', data=station_data),
-        dcc.Store(id='selected-station-data', data=initial_selected_station),
-        html.Div(id="selected-station"),
+        # Only ids are kept in the browser, the city list stays on the server (klimadaten/city_table.py)
+        dcc.Store(id='city-table'),
+        dcc.Store(id='selected-station', data=INITIAL_CITY_ID),
         html.Div(
             [
                 dcc.Graph(id="station-map", style={"width": "70%", "display": "inline-block"}),
                 html.Div(
                     [
                         html.P('Wähle eine Ortschaft auf der Karte für Observationen im letzten Jahr.'),
+                        html.P(id='return-level'),
                         html.H2(),
                         html.Label('Windgeschwindigkeit:'),
                         dcc.Dropdown(
@@ -124,18 +131,29 @@ app.layout = html.Div(
                                      scale in BEAUFORT_SCALE.values()],
                             value=75,
                         ),
+                        dcc.RadioItems(
+                            id='chart-mode',
+                            options=[
+                                {'label': ' Ortschaft', 'value': 'city'},
+                                {'label': ' ganzes Land', 'value': 'country'},
+                            ],
+                            value='city',
+                            inline=True,
+                            inputStyle={'margin-left': '10px'},
+                        ),
                         html.P('für Vergleich und Langzeitanalyse'),
                         html.Label('Auswahl der zweiten Ortschaft zum Vergleich:'),
                         dcc.Dropdown(
                             id='city-dropdown',
-                            options=[{'label': f"{city.name}, {city.country}", 'value': city.id} for city in
-                                     City.objects.all()],
+                            options=[],
                             value=1756121125,  # Default value Brugg
                         ),
                         html.Label('Jahr das verglichen werden soll:'),
                         dcc.Dropdown(
                             id='year-dropdown',
-                            options=[{'label': str(year), 'value': year} for year in range(1940, 2025)],
+                            # Up to the current year, so the year of every detected storm can be selected
+                            options=[{'label': str(year), 'value': year} for year in
+                                     range(1940, datetime.now().year + 1)],
                             value=1991,
                         ),
                         html.Label('Monat:'),
@@ -157,6 +175,12 @@ app.layout = html.Div(
                             ],
                             value='04',
                         ),
+                        html.Label('Historische Stürme:'),
+                        dcc.Dropdown(
+                            id='storm-dropdown',
+                            options=[],
+                            placeholder='Sturm auswählen',
+                        ),
 
                     ],
                     style={"width": "25%", "display": "inline-block", "verticalAlign": "top", "padding": "20px"}
@@ -214,50 +238,121 @@ app.layout = html.Div(
 
 
 @app.callback(
-    [Output("station-map", "figure"), Output("selected-station", "children")],
-    [Input("station-map", "clickData")],
-    [State("station-data", "data"), State("selected-station-data", "data")]
+    [Output("station-map", "figure"), Output("selected-station", "data"), Output("city-table", "data")],
+    [Input("station-map", "clickData"), Input("storm-dropdown", "value")],
+    [State("selected-station", "data")]
 )
-def update_map(clickData, station_data, selected_station):
-    df = pd.DataFrame(station_data)
-    fig_map = px.scatter_mapbox(
-        df,
-        lat="lat",
-        lon="lon",
-        hover_name="name",
-        hover_data=["country", "iso2"],
-        zoom=5,
-        mapbox_style="open-street-map",
-        color_discrete_sequence=[SECONDARY_COLOR],
-    )
-    fig_map.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
-
-    if clickData:
-        selected_station["name"] = clickData["points"][0]["hovertext"]
-        selected_station["lat"] = clickData["points"][0]["lat"]
-        selected_station["lon"] = clickData["points"][0]["lon"]
-        selected_station["country"] = clickData["points"][0]["customdata"][0]
-        selected_station["iso2"] = clickData["points"][0]["customdata"][1]
-
-    fig_map.update_layout(
-        mapbox=dict(
-            center=dict(
-                lat=int(selected_station["lat"]), lon=int(selected_station["lon"])
-            ),  # Center the map on Europe
-            zoom=4,
-        )
+@profiled_callback
+def update_map(clickData, storm_id, selected_id):
+    cities = city_table.current()
+    triggered = [trigger["prop_id"] for trigger in dash.callback_context.triggered]
+    center, zoom = None, 4
+
+    clicked_id = None
+    if "storm-dropdown.value" in triggered and storm_id:
+        # Jump to the storm and select the city with the strongest gust
+        storm = StormEvent.objects.get(id=storm_id)
+        clicked_id = storm.peak_city_id
+        center, zoom = dict(lat=float(storm.lat), lon=float(storm.lon)), 6
+    elif clickData:
+        # customdata carries the city id
+        clicked_id = clickData["points"][0]["customdata"]
+    if cities.index(clicked_id) is not None:
+        selected_id = clicked_id
+
+    selected_station = cities.city(selected_id) or cities.city(INITIAL_CITY_ID)
+    if center is None and selected_station:
+        center = dict(lat=int(selected_station["lat"]), lon=int(selected_station["lon"]))
+
+    fig_map = figures.scatter_map(
+        cities.lat,
+        cities.lon,
+        hovertext=cities.name + "<br>" + cities.country + " (" + cities.iso2 + ")",
+        customdata=cities.ids,
+        customdata_dtype="u4",
+        color=SECONDARY_COLOR,
+        center=center,
+        zoom=zoom,
+        typed=figures.DASH_TYPED_ARRAYS,
     )
-    return fig_map, selected_station
+    return fig_map, selected_id, cities.key
+
+
+def lookup_city(city_id, table_key, stored_coordinates=False):
+    # The rows come from the same table version as the map the user clicked on
+    selected_station = city_table.get(table_key).city(city_id, stored_coordinates)
+    if selected_station is None:
+        raise PreventUpdate
+    return selected_station
+
+
+@app.callback(
+    Output('city-dropdown', 'options'),
+    [Input('city-dropdown', 'search_value')],
+)
+@profiled_callback
+def update_city_options(search_value):
+    # Loaded with the page, at import the city table may not have all its columns yet (before migrate)
+    if search_value:
+        raise PreventUpdate
+    cities = city_table.current()
+    return [
+        {'label': f"{name}, {country}", 'value': int(city_id)}
+        for city_id, name, country in zip(cities.ids, cities.name, cities.country)
+    ]
+
+
+@app.callback(
+    Output('storm-dropdown', 'options'),
+    [Input('storm-dropdown', 'search_value')],
+)
+@profiled_callback
+def update_storm_options(search_value):
+    # Loaded with the page instead of at import, typing only filters the loaded options
+    if search_value:
+        raise PreventUpdate
+    return storm_options()
+
+
+@app.callback(
+    [Output('year-dropdown', 'value'), Output('month-dropdown', 'value')],
+    [Input('storm-dropdown', 'value')],
+    prevent_initial_call=True,
+)
+@profiled_callback
+def jump_to_storm(storm_id):
+    if not storm_id:
+        raise PreventUpdate
+    storm = StormEvent.objects.get(id=storm_id)
+    return storm.peak_day.year, f"{storm.peak_day.month:02d}"
 
 
 @app.callback(
     [Output("wind-speed-lineplot", "figure"), Output("wind-speed-barplot", "figure")],
-    [Input("selected-station", "children"), Input('windspeed-dropdown', 'value')],
+    [Input("selected-station", "data"), Input('windspeed-dropdown', 'value'), Input('chart-mode', 'value')],
+    [State("city-table", "data")]
 )
-def update_plots(selected_station, selected_windspeed):
+@profiled_callback
+def update_plots(selected_id, selected_windspeed, chart_mode='city', table_key=None):
+    selected_station = lookup_city(selected_id, table_key)
     today = pd.Timestamp.now().normalize()  # Get current date without time
     start_date = (today - timedelta(days=365 + 10)).strftime('%Y-%m-%d')  # One year and 10 days ago
     end_date = (today - timedelta(days=10)).strftime('%Y-%m-%d')  # 10 days ago
+    if chart_mode == 'country':
+        return country_plots(selected_station, selected_windspeed, start_date, end_date)
+    try:
+        return city_plots(selected_station, selected_windspeed, start_date, end_date)
+    except UpstreamUnavailable:
+        return unavailable_figure(), unavailable_figure()
+
+
+def unavailable_figure():
+    # Not cached, the next callback asks the archive again
+    return px.line(title="Open-Meteo antwortet gerade nicht, bitte später nochmals versuchen")
+
+
+@cached_call()
+def city_plots(selected_station, selected_windspeed, start_date, end_date):
     daily_dataframe = call_open_meteo(selected_station, start_date, end_date)
 
     # last_year = daily_dataframe['date'].max().year
@@ -266,10 +361,10 @@ def update_plots(selected_station, selected_windspeed):
     fig_lineplot = px.line(
         last_year,
         x="date",
-        y="wind_speed_10m_max",
+        y="wind_gusts_10m_max",
         title=f"Höchste Windgeschwindigkeit pro Tag in {selected_station['name']}, {selected_station['country']} im letzten Jahr",
         labels={
-            "wind_speed_10m_max": "Maximale Windgeschwindigkeit (km/h)",
+            "wind_gusts_10m_max": "Maximale Windgeschwindigkeit (km/h)",
             "date": "Datum",
         },
     )
@@ -282,7 +377,7 @@ def update_plots(selected_station, selected_windspeed):
     # daily_dataframe['date'] = pd.to_datetime(daily_dataframe['date'])
 
     # Filter data for wind speed > selected_windspeed and count days
-    over_selected_windspeed = last_year[last_year["wind_speed_10m_max"] > selected_windspeed]
+    over_selected_windspeed = last_year[last_year["wind_gusts_10m_max"] > selected_windspeed]
     start = over_selected_windspeed["date"].min()
     end = over_selected_windspeed["date"].max()
     # Creating a complete range of months
@@ -316,13 +411,72 @@ def update_plots(selected_station, selected_windspeed):
     return fig_lineplot, fig_barplot
 
 
+def country_plots(selected_station, selected_windspeed, start_date, end_date):
+    # Aggregated by "manage.py build_country_series" from the stored series of all cities in the country
+    country_data = country_series.read(selected_station['iso2'], start_date, end_date)
+    if country_data is None:
+        title = f"Für {selected_station['country']} sind noch keine Landesdaten aggregiert"
+        return px.line(title=title), px.bar(title=title)
+
+    level = country_series.beaufort_level(selected_windspeed)
+    share = country_data[f"share_bf{level}"] * 100
+
+    fig_lineplot = px.line(
+        country_data,
+        x="date",
+        y=["max", "mean"],
+        title=f"Höchste Windgeschwindigkeit pro Tag in {selected_station['country']} im letzten Jahr",
+        labels={"value": "Windgeschwindigkeit (km/h)", "date": "Datum", "variable": ""},
+        color_discrete_map={"max": STATION_COLOR, "mean": CITY_COLOR},
+    )
+    fig_lineplot.for_each_trace(lambda trace: trace.update(name={"max": "Maximum", "mean": "Mittel"}[trace.name]))
+    fig_lineplot.update_layout(plot_bgcolor=BACKGROUND_COLOR)
+
+    fig_barplot = px.bar(
+        x=country_data["date"],
+        y=share,
+        range_y=[0, 100],
+        title=f"Anteil der Ortschaften mit über {selected_windspeed} km/h pro Tag",
+        labels={"y": "Anteil Ortschaften (%)", "x": "Datum"},
+        color_discrete_sequence=[STATION_COLOR],
+    )
+    return fig_lineplot, fig_barplot
+
+
+@app.callback(
+    Output('return-level', 'children'),
+    [Input("selected-station", "data")],
+    [State("city-table", "data")]
+)
+@profiled_callback
+def update_return_level(selected_id, table_key=None):
+    selected_station = lookup_city(selected_id, table_key)
+    # Precomputed by "manage.py compute_climatology", nothing is fitted here
+    result = climatology.return_level(selected_station["id"], period=50)
+    if result is None or result[0] != result[0]:
+        return f"Für {selected_station['name']} ist noch keine 50-jährliche Böe berechnet."
+    level, years = result
+    return f"50-jährliche Böe in {selected_station['name']}: {level:.0f} km/h (GEV aus {years} Jahresmaxima)"
+
+
 @app.callback(
     Output('yearly-comparison-plot', 'figure'),
     [Input('city-dropdown', 'value'),
      Input('year-dropdown', 'value'),
-     Input("selected-station", "children")]
+     Input("selected-station", "data")],
+    [State("city-table", "data")]
 )
-def update_yearly_comparison_plot(city_id, year, selected_station):
+@profiled_callback
+def update_yearly_comparison_plot(city_id, year, selected_id, table_key=None):
+    try:
+        return yearly_comparison_plot(city_id, year, selected_id, table_key)
+    except UpstreamUnavailable:
+        return unavailable_figure()
+
+
+@cached_call()
+def yearly_comparison_plot(city_id, year, selected_id, table_key=None):
+    selected_station = lookup_city(selected_id, table_key)
     start_date = f"{year}-01-01"
     end_date = f"{year}-12-31"
     current_year = datetime.now().year
@@ -331,24 +485,21 @@ def update_yearly_comparison_plot(city_id, year, selected_station):
         start_date = (today - timedelta(days=365 + 10)).strftime('%Y-%m-%d')
         end_date = (today - timedelta(days=10)).strftime('%Y-%m-%d')
 
-    city = City.objects.get(id=city_id)
+    city = lookup_city(city_id, table_key, stored_coordinates=True)
 
-    city_data = call_open_meteo({
-        'lat': city.lat,
-        'lon': city.lon
-    }, start_date, end_date)
+    city_data = call_open_meteo(city, start_date, end_date)
 
     station_data = call_open_meteo(selected_station, start_date, end_date)
     station_label = f"{selected_station['name']} ({selected_station['iso2']})"
-    city_label = f"{city.name} ({city.iso2})"
+    city_label = f"{city['name']} ({city['iso2']})"
 
     # Combine data and create plot
     fig = px.line(
         pd.concat([station_data.assign(Ortschaft=station_label), city_data.assign(Ortschaft=city_label)]),
         x='date',
-        y='wind_speed_10m_max',
+        y='wind_gusts_10m_max',
         color='Ortschaft',
-        labels={'wind_speed_10m_max': 'Windgeschwindigkeit', 'date': 'Jahr'},
+        labels={'wind_gusts_10m_max': 'Windgeschwindigkeit', 'date': 'Jahr'},
         color_discrete_map={station_label: STATION_COLOR, city_label: CITY_COLOR},
         title=f"Vergleich der Windgeschwindigkeiten von {station_label} und {city_label} im Jahr {year}"
     )
@@ -359,43 +510,42 @@ def update_yearly_comparison_plot(city_id, year, selected_station):
     Output('monthly-comparison-plot', 'figure'),
     [Input('city-dropdown', 'value'),
      Input('month-dropdown', 'value'),
-     Input("selected-station", "children"),
-     Input('windspeed-dropdown', 'value')]
+     Input("selected-station", "data"),
+     Input('windspeed-dropdown', 'value')],
+    [State("city-table", "data")]
 )
-def update_monthly_comparison_plot(city_id, month, selected_station, selected_windspeed):
+@profiled_callback
+def update_monthly_comparison_plot(city_id, month, selected_id, selected_windspeed, table_key=None):
+    try:
+        return monthly_comparison_plot(city_id, month, selected_id, selected_windspeed, table_key)
+    except UpstreamUnavailable:
+        return unavailable_figure()
+
+
+def days_over_per_year(city, month, windspeed, years):
+    """Count the days of ``month`` with gusts over ``windspeed`` for each of ``years``."""
+    first, last = date(years[0], 1, 1), date(years[-1], 12, 31)
+    # The whole range with at most one upstream call, usually it is in the series store already
+    series_store.ensure_series(SimpleNamespace(**city), first, last)
+    days, values = series_store.read_series(city['id'], first, last)
+    over = pd.Series(values > windspeed, index=days)[days.month == int(month)]
+    return over.groupby(over.index.year).sum().reindex(years, fill_value=0).tolist()
+
+
+@cached_call()
+def monthly_comparison_plot(city_id, month, selected_id, selected_windspeed, table_key=None):
+    selected_station = lookup_city(selected_id, table_key)
     current_year = datetime.now().year
     years = range(1940, current_year)
+    if not isinstance(month, str):
+        month = "04"
 
-    city_days_over_selected_windspeed = []
-    station_days_over_selected_windspeed = []
-
-    dropdown_city = City.objects.get(id=city_id)
-
-    for year in years:
-        start_date = f"{year}-04-01"
-        end_date = f"{year}-04-31"
-        if isinstance(month, str):
-            start_date = f"{year}-{month}-01"
-            end_date = f"{year}-{month}-31"
+    dropdown_city = lookup_city(city_id, table_key, stored_coordinates=True)
 
-        city_data = call_open_meteo({
-            'lat': dropdown_city.lat,
-            'lon': dropdown_city.lon
-        }, start_date, end_date)
-
-        station_data = call_open_meteo({
-            'lat': selected_station['lat'],
-            'lon': selected_station['lon']
-        }, start_date, end_date)
-
-        # Filter data for wind speed > selected_windspeed and count days
-        city_days_count = city_data[city_data['wind_speed_10m_max'] > selected_windspeed].shape[0]
-        station_days_count = station_data[station_data['wind_speed_10m_max'] > selected_windspeed].shape[0]
-
-        city_days_over_selected_windspeed.append(city_days_count)
-        station_days_over_selected_windspeed.append(station_days_count)
-        station_label = f"{selected_station['name']} ({selected_station['iso2']})"
-        city_label = f"{dropdown_city.name} ({dropdown_city.iso2})"
+    city_days_over_selected_windspeed = days_over_per_year(dropdown_city, month, selected_windspeed, years)
+    station_days_over_selected_windspeed = days_over_per_year(selected_station, month, selected_windspeed, years)
+    station_label = f"{selected_station['name']} ({selected_station['iso2']})"
+    city_label = f"{dropdown_city['name']} ({dropdown_city['iso2']})"
 
     # Create a DataFrame for plotting
     comparison_df = pd.DataFrame({
@@ -418,41 +568,3 @@ def update_monthly_comparison_plot(city_id, month, selected_station, selected_wi
 
     return fig
 
-
-def call_open_meteo(selected_station, start_date, end_date):
-    # Setup the Open-Meteo API client with cache and retry on error
-    cache_session = requests_cache.CachedSession(".cache", expire_after=-1)
-    retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
-    openmeteo = openmeteo_requests.Client(session=retry_session)
-
-    # The order of variables in hourly or daily is important to assign them correctly below
-    url = "https://archive-api.open-meteo.com/v1/archive"
-    params = {
-        "latitude": selected_station["lat"],
-        "longitude": selected_station["lon"],
-        "start_date": start_date,
-        "end_date": end_date,
-        "daily": "wind_gusts_10m_max",
-        "timezone": "Europe/Berlin",
-    }
-    responses = openmeteo.weather_api(url, params=params)
-
-    # Process first location. Add a for-loop for multiple locations or weather models
-    response = responses[0]
-
-    # Process daily data. The order of variables needs to be the same as requested.
-    daily = response.Daily()
-    daily_wind_gusts_10m_max = daily.Variables(0).ValuesAsNumpy()
-
-    daily_data = {
-        "date": pd.date_range(
-            start=pd.to_datetime(daily.Time(), unit="s", utc=True),
-            end=pd.to_datetime(daily.TimeEnd(), unit="s", utc=True),
-            freq=pd.Timedelta(seconds=daily.Interval()),
-            inclusive="left",
-        ),
-        "wind_speed_10m_max": daily_wind_gusts_10m_max,
-    }
-
-    daily_dataframe = pd.DataFrame(data=daily_data)
-    return daily_dataframe
@@ -0,0 +1,111 @@
+"""Fast construction of map figures with many points.
+
+plotly.express validates and rebuilds the whole figure on every call. Here
+the layout is prebuilt once and only the traces are created per request,
+as plain dicts. Coordinates are sent as base64 encoded typed arrays
+(``{"dtype": "f4", "bdata": ...}``), which plotly.js >= 2.28 decodes
+directly into Float32Arrays.
+"""
+import base64
+import copy
+import re
+
+import dash
+import numpy as np
+from plotly.offline import get_plotlyjs_version
+
+EUROPE_NORTH = 71.5  # North Cape in Norway
+EUROPE_SOUTH = 36  # Punta de Tarifa in Spain
+EUROPE_WEST = -25  # Iceland
+EUROPE_EAST = 60  # Ural Mountains in Russia
+
+DTYPE_CODES = {
+    np.dtype("<f8"): "f8",
+    np.dtype("<f4"): "f4",
+    np.dtype("<i4"): "i4",
+    np.dtype("<u4"): "u4",
+    np.dtype("<i2"): "i2",
+    np.dtype("<u2"): "u2",
+    np.dtype("i1"): "i1",
+    np.dtype("u1"): "u1",
+}
+
+
+def version_tuple(version):
+    return tuple(int(part) for part in re.findall(r"\d+", version)[:3])
+
+
+# plotly.js understands typed arrays since 2.28, Dash bundles it since 2.16
+PLOTLY_TYPED_ARRAYS = version_tuple(get_plotlyjs_version()) >= (2, 28, 0)
+DASH_TYPED_ARRAYS = version_tuple(dash.__version__) >= (2, 16, 0)
+
+MAP_LAYOUT = {
+    "mapbox": {
+        "style": "open-street-map",
+        "zoom": 4,
+        "center": {"lat": 50, "lon": 10},
+    },
+    "margin": {"r": 0, "t": 0, "l": 0, "b": 0},
+    "hovermode": "closest",
+    "showlegend": False,
+}
+
+EUROPE_MAP_LAYOUT = copy.deepcopy(MAP_LAYOUT)
+EUROPE_MAP_LAYOUT["mapbox"].update(
+    zoom=7,
+    bounds={
+        "west": EUROPE_WEST,
+        "east": EUROPE_EAST,
+        "south": EUROPE_SOUTH,
+        "north": EUROPE_NORTH,
+    },
+)
+
+
+def encode_array(values, dtype, typed=True):
+    """Encode a numeric array as typed array, or as plain list if ``typed`` is False."""
+    if not typed:
+        return np.asarray(values).tolist()
+    values = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder("<"))
+    return {
+        "dtype": DTYPE_CODES[values.dtype],
+        "bdata": base64.b64encode(values.tobytes()).decode("ascii"),
+    }
+
+
+def scatter_map(
+    lat,
+    lon,
+    hovertext,
+    text=None,
+    customdata=None,
+    customdata_dtype="f8",
+    hovertemplate="<b>%{hovertext}</b><extra></extra>",
+    color=None,
+    layout=MAP_LAYOUT,
+    center=None,
+    zoom=None,
+    typed=True,
+):
+    """Return a scattermapbox (WebGL) figure dict built on top of a prebuilt ``layout``."""
+    trace = {
+        "type": "scattermapbox",
+        "mode": "markers",
+        "lat": encode_array(lat, "f4", typed),
+        "lon": encode_array(lon, "f4", typed),
+        "hovertext": list(hovertext),
+        "hovertemplate": hovertemplate,
+        "marker": {"color": color} if color else {},
+    }
+    if text is not None:
+        trace["text"] = list(text)
+    if customdata is not None:
+        trace["customdata"] = encode_array(customdata, customdata_dtype, typed)
+
+    # The template is small, a deep copy keeps callers from changing it for later figures
+    figure_layout = copy.deepcopy(layout)
+    if center is not None:
+        figure_layout["mapbox"]["center"] = center
+    if zoom is not None:
+        figure_layout["mapbox"]["zoom"] = zoom
+    return {"data": [trace], "layout": figure_layout}
@@ -1,15 +1,37 @@
+from datetime import date
+
 from django import forms
-from .models import Station
+from . import aggregates
+from .models import City
 
 
 class CountryForm(forms.Form):
-    country_choices = [
-        (station, station)
-        for station in Station.objects.values_list("country", flat=True)
-        .distinct()
-        .order_by("country")
-    ]
-    country_choices.insert(0, ("", "Select a Country"))
+    # Read from the precomputed aggregates, evaluated per form instead of at import time
     country = forms.ChoiceField(
-        choices=country_choices, required=False, initial="SWITZERLAND"
+        choices=aggregates.country_choices, required=False, initial="SWITZERLAND"
     )
+
+
+class ExportForm(forms.Form):
+    # Every city may need its whole series fetched from Open-Meteo before the export starts
+    MAX_CITIES = 20
+
+    city = forms.ModelMultipleChoiceField(queryset=City.objects.order_by("id"))
+    start = forms.DateField(initial=date(1940, 1, 1), required=False)
+    end = forms.DateField(required=False)
+    format = forms.ChoiceField(choices=[("csv", "CSV"), ("parquet", "Parquet")], initial="csv", required=False)
+
+    def clean_city(self):
+        cities = self.cleaned_data["city"]
+        if len(cities) > self.MAX_CITIES:
+            raise forms.ValidationError(f"At most {self.MAX_CITIES} cities can be exported at once.")
+        return cities
+
+    def clean(self):
+        cleaned_data = super().clean()
+        cleaned_data["start"] = cleaned_data.get("start") or self.fields["start"].initial
+        cleaned_data["end"] = cleaned_data.get("end") or date.today()
+        cleaned_data["format"] = cleaned_data.get("format") or "csv"
+        if cleaned_data["start"] > cleaned_data["end"]:
+            raise forms.ValidationError("start must not be after end.")
+        return cleaned_data
@@ -0,0 +1,243 @@
+"""Date partitioned on-disk store for gridded daily values (e.g. E-OBS ``FX``).
+
+Layout below ``KLIMADATEN_GRID_STORE``::
+
+    coords.npz                  lat/lon of every grid point, stored once
+    FX/1979/19791205.npy        float32 values of one day, aligned with coords.npz
+
+Day files are plain ``.npy`` arrays so they can be memory-mapped and only the
+selected days are read from disk.
+"""
+import logging
+import os
+import re
+from datetime import date
+from pathlib import Path
+
+from django.conf import settings
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VARIABLE = "FX"
+
+# Grid coordinates are matched on a 0.01° lattice, E-OBS uses 0.1° or 0.25°
+KEY_SCALE = 100
+LON_OFFSET = 1000 * KEY_SCALE
+
+DATE_PATTERN = re.compile(r"(\d{8})")
+
+_coords_cache = {}
+
+
+def store_dir():
+    return Path(
+        getattr(
+            settings,
+            "KLIMADATEN_GRID_STORE",
+            settings.BASE_DIR / "klimadaten" / "data" / "grid",
+        )
+    )
+
+
+def coords_path():
+    return store_dir() / "coords.npz"
+
+
+def day_path(day, variable=DEFAULT_VARIABLE):
+    return store_dir() / variable / f"{day:%Y}" / f"{day:%Y%m%d}.npy"
+
+
+def date_from_filename(path):
+    """Extract the date from file names like ``wws19791205.csv``."""
+    match = DATE_PATTERN.search(Path(path).stem)
+    if not match:
+        raise ValueError(f"No date in file name {path}")
+    return pd.Timestamp(match.group(1)).date()
+
+
+def coordinate_keys(lat, lon):
+    lat_key = np.rint(np.asarray(lat, dtype=np.float64) * KEY_SCALE).astype(np.int64)
+    lon_key = np.rint(np.asarray(lon, dtype=np.float64) * KEY_SCALE).astype(np.int64)
+    return lat_key * (2 * LON_OFFSET) + lon_key + LON_OFFSET
+
+
+def load_coords():
+    """Return ``(lat, lon, keys)`` of the shared coordinate index or ``None``."""
+    path = coords_path()
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+    cached = _coords_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with np.load(path) as data:
+        coords = (data["lat"], data["lon"], data["keys"])
+    _coords_cache[path] = (mtime, coords)
+    return coords
+
+
+def write_coords(lat, lon):
+    keys = coordinate_keys(lat, lon)
+    keys, first = np.unique(keys, return_index=True)
+    lat = np.asarray(lat, dtype=np.float32)[first]
+    lon = np.asarray(lon, dtype=np.float32)[first]
+    path = coords_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp.npz")
+    np.savez(tmp_path, lat=lat, lon=lon, keys=keys)
+    os.replace(tmp_path, path)
+    return lat, lon, keys
+
+
+def align_into(target, lat, lon, values):
+    """Write point values into ``target`` which is aligned with the coordinate index.
+
+    Points outside the index are dropped, the number of dropped points with a value is returned.
+    """
+    keys = load_coords()[2]
+    values = np.asarray(values, dtype=np.float32)
+    point_keys = coordinate_keys(lat, lon)
+    positions = np.searchsorted(keys, point_keys)
+    positions[positions == len(keys)] = 0
+    known = keys[positions] == point_keys
+    target[positions[known]] = values[known]
+    return int((~known & np.isfinite(values)).sum())
+
+
+def empty_day():
+    return np.full(len(load_coords()[0]), np.nan, dtype=np.float32)
+
+
+def save_day(day, aligned, variable=DEFAULT_VARIABLE):
+    path = day_path(day, variable)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first so a crash never leaves half a day behind
+    tmp_path = path.with_name(f".{path.stem}.{os.getpid()}.tmp.npy")
+    np.save(tmp_path, np.asarray(aligned, dtype=np.float32))
+    os.replace(tmp_path, path)
+
+
+def log_dropped(day, dropped):
+    if dropped:
+        logger.warning("%s: %d points with a value are outside the coordinate index and were dropped", day, dropped)
+
+
+def write_day(day, lat, lon, values, variable=DEFAULT_VARIABLE):
+    """Store the values of one day, returns the number of dropped points.
+
+    The first day written defines the coordinate index.
+    """
+    if load_coords() is None:
+        write_coords(lat, lon)
+    aligned = empty_day()
+    dropped = align_into(aligned, lat, lon, values)
+    save_day(day, aligned, variable)
+    log_dropped(day, dropped)
+    return dropped
+
+
+def has_day(day, variable=DEFAULT_VARIABLE):
+    return day_path(day, variable).exists()
+
+
+def load_day(day, variable=DEFAULT_VARIABLE):
+    """Memory-map the values of one day, ``None`` if the day is not stored."""
+    path = day_path(day, variable)
+    if not path.exists():
+        return None
+    return np.load(path, mmap_mode="r")
+
+
+def available_days(variable=DEFAULT_VARIABLE):
+    variable_dir = store_dir() / variable
+    if not variable_dir.exists():
+        return []
+    return sorted(
+        date_from_filename(path) for path in variable_dir.glob("*/*.npy")
+    )
+
+
+def days_in(year, month=None, day=None):
+    if day:
+        return [date(year, month, day)]
+    if month:
+        start = pd.Timestamp(year=year, month=month, day=1)
+        end = start + pd.offsets.MonthEnd(1)
+    else:
+        start = pd.Timestamp(year=year, month=1, day=1)
+        end = pd.Timestamp(year=year, month=12, day=31)
+    return [timestamp.date() for timestamp in pd.date_range(start, end, freq="D")]
+
+
+def aggregate(year, month=None, day=None, how="max", variable=DEFAULT_VARIABLE):
+    """Aggregate the stored days of a day, month or year per grid point.
+
+    Returns a DataFrame with ``lat``, ``lon`` and the variable, grid points
+    without any value in the period are left out.
+    """
+    coords = load_coords()
+    if coords is None:
+        return pd.DataFrame(columns=["lat", "lon", variable])
+    lat, lon, _ = coords
+
+    result = None
+    count = np.zeros(len(lat), dtype=np.int32)
+    for selected_day in days_in(year, month, day):
+        values = load_day(selected_day, variable)
+        if values is None:
+            continue
+        if how == "max":
+            if result is None:
+                result = np.full(len(lat), np.nan, dtype=np.float64)
+            np.fmax(result, values, out=result)
+        elif how == "mean":
+            if result is None:
+                result = np.zeros(len(lat), dtype=np.float64)
+            valid = ~np.isnan(values)
+            result += np.where(valid, values, 0)
+            count += valid
+        else:
+            raise ValueError(f"Unknown aggregation {how}")
+
+    if result is None:
+        return pd.DataFrame(columns=["lat", "lon", variable])
+    if how == "mean":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result = np.where(count > 0, result / count, np.nan)
+
+    valid = ~np.isnan(result)
+    return pd.DataFrame({"lat": lat[valid], "lon": lon[valid], variable: result[valid]})
+
+
+def ensure_coords_from_csv(path):
+    """Create the coordinate index from the points of a CSV file if there is none yet."""
+    if load_coords() is None:
+        df = pd.read_csv(path, usecols=["lat", "lon"], dtype=np.float32)
+        write_coords(df["lat"].values, df["lon"].values)
+
+
+def import_csv(path, variable=DEFAULT_VARIABLE, day=None, chunksize=None):
+    """Convert one daily ``lat,lon,<variable>`` CSV file into the store.
+
+    With ``chunksize`` the file is read in chunks of that many rows.
+    """
+    day = day or date_from_filename(path)
+    ensure_coords_from_csv(path)
+    reader = pd.read_csv(
+        path,
+        usecols=["lat", "lon", variable],
+        dtype={"lat": np.float32, "lon": np.float32, variable: np.float32},
+        chunksize=chunksize,
+    )
+    chunks = reader if chunksize else [reader]
+
+    aligned = empty_day()
+    dropped = 0
+    for chunk in chunks:
+        dropped += align_into(aligned, chunk["lat"].values, chunk["lon"].values, chunk[variable].values)
+    save_day(day, aligned, variable)
+    log_dropped(day, dropped)
+    return day, dropped
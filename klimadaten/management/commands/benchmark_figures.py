@@ -0,0 +1,69 @@
+import json
+import time
+
+import pandas as pd
+import plotly.express as px
+import plotly.io as pio
+from django.core.management.base import BaseCommand
+
+from klimadaten import figures
+from klimadaten.models import City
+
+
+def build_express(df):
+    # What update_map did before klimadaten.figures existed
+    fig = px.scatter_mapbox(
+        df,
+        lat="lat",
+        lon="lon",
+        hover_name="name",
+        hover_data=["country", "iso2"],
+        zoom=5,
+        mapbox_style="open-street-map",
+    )
+    fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
+    fig.update_layout(mapbox=dict(center=dict(lat=61, lon=-6), zoom=4))
+    return fig.to_plotly_json()
+
+
+def build_template(df, typed):
+    return figures.scatter_map(
+        df["lat"],
+        df["lon"],
+        hovertext=df["name"] + "<br>" + df["country"] + " (" + df["iso2"] + ")",
+        customdata=df["id"],
+        customdata_dtype="u4",
+        center=dict(lat=61, lon=-6),
+        zoom=4,
+        typed=typed,
+    )
+
+
+class Command(BaseCommand):
+    help = "Compare build time and payload size of the city map figure before and after klimadaten.figures"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=10)
+        parser.add_argument("--points", type=int, default=0, help="Replicate the cities up to this many points")
+
+    def handle(self, *args, **options):
+        df = pd.DataFrame.from_records(City.objects.values("id", "name", "lat", "lon", "country", "iso2"))
+        df["lat"] = df["lat"].astype(float)
+        df["lon"] = df["lon"].astype(float)
+        if options["points"] > len(df):
+            df = pd.concat([df] * (options["points"] // len(df) + 1), ignore_index=True).iloc[: options["points"]]
+
+        self.stdout.write(f"{len(df)} points, {options['repeat']} runs each")
+        self.stdout.write(f"{'variant':<28}{'build ms':>10}{'payload KiB':>14}")
+        variants = [
+            ("plotly.express", lambda: build_express(df)),
+            ("template, lists", lambda: build_template(df, typed=False)),
+            ("template, typed arrays", lambda: build_template(df, typed=True)),
+        ]
+        for name, build in variants:
+            start = time.perf_counter()
+            for _ in range(options["repeat"]):
+                figure = build()
+            elapsed = (time.perf_counter() - start) / options["repeat"] * 1000
+            payload = pio.to_json(figure, validate=False) if name == "plotly.express" else json.dumps(figure)
+            self.stdout.write(f"{name:<28}{elapsed:>10.1f}{len(payload) / 1024:>14.1f}")
@@ -0,0 +1,32 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from klimadaten import country_series, openmeteo, series_store
+
+
+class Command(BaseCommand):
+    help = "Aggregate the stored city series into daily series per country"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=date.fromisoformat, default=series_store.SERIES_START)
+        parser.add_argument("--end", type=date.fromisoformat, default=None, help="Defaults to the last archived day")
+        parser.add_argument("--chunk-days", type=int, default=366, help="Days held in memory at once")
+        parser.add_argument("--variable", default=openmeteo.DAILY_VARIABLE)
+
+    def handle(self, *args, **options):
+        start = options["start"]
+        end = options["end"] or series_store.last_available_day()
+        if start > end:
+            raise CommandError("--start must not be after --end")
+
+        started = time.perf_counter()
+        result = country_series.build(start, end, options["variable"], chunk_days=options["chunk_days"])
+        country_series.save(result, options["variable"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Aggregated {len(result['countries'])} countries from {start} to {end} "
+                f"in {time.perf_counter() - started:.1f}s."
+            )
+        )
@@ -0,0 +1,52 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from klimadaten import climatology, openmeteo, series_store
+from klimadaten.models import City
+
+
+class Command(BaseCommand):
+    help = "Compute gust percentiles, annual maxima and return levels of all cities in the series store"
+
+    def add_arguments(self, parser):
+        last_full_year = series_store.last_available_day().year - 1
+        parser.add_argument("--start-year", type=int, default=series_store.SERIES_START.year)
+        parser.add_argument("--end-year", type=int, default=last_full_year)
+        parser.add_argument("--city", type=int, action="append", help="City id, defaults to all stored cities")
+        parser.add_argument("--fetch", action="store_true", help="Fetch missing days of the cities first")
+        parser.add_argument("--batch-size", type=int, default=256, help="Cities held in memory at once")
+        parser.add_argument("--variable", default=openmeteo.DAILY_VARIABLE)
+
+    def handle(self, *args, **options):
+        start_year, end_year = options["start_year"], options["end_year"]
+        if start_year > end_year:
+            raise CommandError("--start-year must not be after --end-year")
+
+        if options["fetch"]:
+            # Only these are fetched, a series stored under another name would hold values of a different variable
+            if options["variable"] not in openmeteo.DAILY_VARIABLES:
+                raise CommandError(f"--fetch supports the variables {', '.join(openmeteo.DAILY_VARIABLES)}")
+            cities = City.objects.all()
+            if options["city"]:
+                cities = cities.filter(id__in=options["city"])
+            for city in cities.iterator():
+                series_store.ensure_series(city, date(start_year, 1, 1), date(end_year, 12, 31))
+
+        city_ids = options["city"] or series_store.stored_city_ids(options["variable"])
+        if not city_ids:
+            raise CommandError("No city series stored, run with --fetch first.")
+
+        started = time.perf_counter()
+        result = climatology.compute(
+            city_ids, start_year, end_year, options["variable"], batch_size=options["batch_size"]
+        )
+        climatology.save(result, options["variable"])
+        fitted = int((result["fitted_years"] >= climatology.MIN_YEARS).sum())
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Computed the climatology {start_year}-{end_year} of {len(city_ids)} cities "
+                f"({fitted} with return levels) in {time.perf_counter() - started:.1f}s."
+            )
+        )
@@ -0,0 +1,76 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min
+
+from klimadaten import openmeteo, series_store, storms
+from klimadaten.models import StormEvent, TableVersion
+
+
+def scan_range(start, end):
+    """Widen ``start`` and ``end`` until no stored storm reaches over them."""
+    while True:
+        stored = StormEvent.objects.filter(end__gte=start, start__lte=end).aggregate(
+            first=Min("start"), last=Max("end")
+        )
+        widened = min(start, stored["first"] or start), max(end, stored["last"] or end)
+        if widened == (start, end):
+            return start, end
+        start, end = widened
+
+
+class Command(BaseCommand):
+    help = "Find storms (many neighbouring cities above Beaufort 9) in the stored city series"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=date.fromisoformat, default=series_store.SERIES_START)
+        parser.add_argument("--end", type=date.fromisoformat, default=None, help="Defaults to the last archived day")
+        parser.add_argument("--threshold", type=float, default=storms.THRESHOLD_KMH, help="Gust in km/h")
+        parser.add_argument("--radius-km", type=float, default=storms.RADIUS_KM, help="Distance of neighbours")
+        parser.add_argument("--min-cities", type=int, default=storms.MIN_CITIES, help="Smallest storm cell")
+        parser.add_argument("--chunk-days", type=int, default=366, help="Days held in memory at once")
+        parser.add_argument("--variable", default=openmeteo.DAILY_VARIABLE)
+
+    def handle(self, *args, **options):
+        start = options["start"]
+        end = options["end"] or series_store.last_available_day()
+        if start > end:
+            raise CommandError("--start must not be after --end")
+        # Storms reaching into the range are deleted below, so they have to be found again as a whole
+        start, end = scan_range(start, end)
+
+        started = time.perf_counter()
+        events, city_ids = storms.detect(
+            start,
+            end,
+            options["variable"],
+            threshold=options["threshold"],
+            radius_km=options["radius_km"],
+            min_cities=options["min_cities"],
+            chunk_days=options["chunk_days"],
+        )
+        with transaction.atomic():
+            StormEvent.objects.filter(end__gte=start, start__lte=end).delete()
+            StormEvent.objects.bulk_create(
+                StormEvent(
+                    start=event.start,
+                    end=event.end,
+                    duration_days=(event.end - event.start).days + 1,
+                    footprint=len(event.cities),
+                    peak_gust=round(event.peak_gust, 1),
+                    peak_day=event.peak_day,
+                    peak_city_id=event.peak_city,
+                    lat=round(event.lat, 6),
+                    lon=round(event.lon, 6),
+                )
+                for event in events
+            )
+        TableVersion.bump("stormevent")
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Found {len(events)} storms in {len(city_ids)} cities from {start} to {end} "
+                f"in {time.perf_counter() - started:.1f}s."
+            )
+        )
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cdk1_2Da.routers import use_primary
+from klimadaten import neighbours
+
+
+class Command(BaseCommand):
+    help = "Link every city to its k nearest stations (haversine distance and elevation difference)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--k",
+            type=int,
+            help=f"Number of stations per city, defaults to that of the current links or {neighbours.DEFAULT_K}. "
+            "Later relinks of single cities keep it.",
+        )
+
+    def handle(self, *args, **options):
+        if options["k"] is not None and options["k"] < 1:
+            raise CommandError("--k must be at least 1")
+        with use_primary():
+            k = options["k"] or neighbours.linked_k()
+            cities = neighbours.rebuild_all(k=k)
+        self.stdout.write(self.style.SUCCESS(f"Successfully linked {cities} cities to their {k} nearest stations."))
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from klimadaten.models import City
+from klimadaten.signals import bulk_load
 import pandas as pd
 
 # Constants for Europe's geographic boundaries
@@ -23,19 +24,20 @@ class Command(BaseCommand):
             & (df["lng"] <= EUROPE_EAST)
         ]
 
-        for _, row in df_europe.iterrows():
-            print(row["city"])
-            City.objects.update_or_create(
-                id=row["id"],
-                defaults={
-                    "name": row["city"],
-                    "country": row["country"],
-                    "iso2": row["iso2"],
-                    "iso3": row["iso3"],
-                    "lat": row["lat"],
-                    "lon": row["lng"],
-                },
-            )
+        with bulk_load("city"):
+            for _, row in df_europe.iterrows():
+                print(row["city"])
+                City.objects.update_or_create(
+                    id=row["id"],
+                    defaults={
+                        "name": row["city"],
+                        "country": row["country"],
+                        "iso2": row["iso2"],
+                        "iso3": row["iso3"],
+                        "lat": row["lat"],
+                        "lon": row["lng"],
+                    },
+                )
 
         self.stdout.write(
             self.style.SUCCESS("Successfully loaded European cities into the database.")
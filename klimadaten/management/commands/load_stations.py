@@ -3,6 +3,7 @@ import csv
 from decimal import Decimal
 from django.conf import settings
 from klimadaten.models import Station
+from klimadaten.signals import bulk_load
 from itertools import islice
 
 # Constants for Europe's geographic boundaries
@@ -42,6 +43,10 @@ class Command(BaseCommand):
 
     def handle(self, *args, **kwargs):
         file_path = settings.BASE_DIR / "klimadaten" / "data" / "stations.txt"
+        with bulk_load("station"):
+            self.load(file_path)
+
+    def load(self, file_path):
         try:
             with open(file_path, mode="r", encoding="utf-8") as csv_file:
                 reader = csv.reader(islice(csv_file, 20, None))
@@ -0,0 +1,434 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+DASH_APP = "/django_plotly_dash/app/StationsMap/"
+PAGES = ["/klimadaten/Datastory", "/klimadaten/stations", "/klimadaten/api/points/cities"]
+
+# Relative frequency of what a user does between two pauses
+ACTIONS = {
+    "click_map": 8,
+    "windspeed": 3,
+    "chart_mode": 2,
+    "compare_city": 3,
+    "year": 3,
+    "month": 2,
+    "storm": 1,
+    "page": 1,
+}
+# Component a dropdown action changes
+DROPDOWNS = {
+    "windspeed": "windspeed-dropdown",
+    "chart_mode": "chart-mode",
+    "compare_city": "city-dropdown",
+    "year": "year-dropdown",
+    "month": "month-dropdown",
+    "storm": "storm-dropdown",
+}
+PERCENTILES = (50, 95, 99)
+
+
+class RequestFailed(Exception):
+    pass
+
+
+class Connection:
+    """A keep-alive HTTP/1.1 connection, ``cookies`` are shared with the other connections of the visitor."""
+
+    def __init__(self, host, port, cookies):
+        self.host, self.port, self.cookies = host, port, cookies
+        self.reader = self.writer = None
+
+    async def exchange(self, method, path, body):
+        # The server may have closed a connection that was idle during the pause, retry once on a new one
+        reused = self.writer is not None
+        try:
+            return await self.send(method, path, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            if not reused:
+                raise
+            return await self.send(method, path, body)
+
+    async def send(self, method, path, body):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        headers = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}"]
+        if self.cookies:
+            headers.append("Cookie: " + "; ".join(f"{key}={value}" for key, value in self.cookies.items()))
+        if body is not None:
+            headers += ["Content-Type: application/json", f"Content-Length: {len(body)}"]
+        self.writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + (body or b""))
+        await self.writer.drain()
+
+        head = (await self.reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        status = int(head[0].split(" ", 2)[1])
+        response_headers = defaultdict(list)
+        for line in head[1:]:
+            if line:
+                key, _, value = line.partition(":")
+                response_headers[key.strip().lower()].append(value.strip())
+        for cookie in response_headers["set-cookie"]:
+            key, _, value = cookie.split(";", 1)[0].partition("=")
+            self.cookies[key] = value
+
+        if "chunked" in ",".join(response_headers["transfer-encoding"]):
+            content = b""
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+                content += chunk[:-2]
+        elif response_headers["content-length"]:
+            content = await self.reader.readexactly(int(response_headers["content-length"][0]))
+        elif status in (204, 304) or method == "HEAD":
+            content = b""
+        else:
+            content = await self.reader.read()
+            self.close()
+        if "close" in response_headers["connection"]:
+            self.close()
+        return status, content
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Browser:
+    """The connections of one visitor, at most ``MAX_CONNECTIONS`` requests run at the same time."""
+
+    MAX_CONNECTIONS = 6  # per host, like Chrome and Firefox
+
+    def __init__(self, host, port, timeout, stats):
+        self.host, self.port, self.timeout, self.stats = host, port, timeout, stats
+        self.cookies = {}
+        self.idle = []
+        self.slots = asyncio.Semaphore(self.MAX_CONNECTIONS)
+
+    async def request(self, name, method, path, body=None):
+        """Send a request, record its latency under ``name`` and return status and body if it succeeded."""
+        async with self.slots:
+            connection = self.idle.pop() if self.idle else Connection(self.host, self.port, self.cookies)
+            started = time.perf_counter()
+            try:
+                status, content = await asyncio.wait_for(connection.exchange(method, path, body), self.timeout)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+                connection.close()
+                self.stats.record(name, time.perf_counter() - started, type(e).__name__)
+                raise RequestFailed(name) from e
+            finally:
+                self.idle.append(connection)
+        error = str(status) if status >= 400 else None
+        self.stats.record(name, time.perf_counter() - started, error)
+        if error:
+            raise RequestFailed(name)
+        return status, content
+
+    def close(self):
+        for connection in self.idle:
+            connection.close()
+        self.idle = []
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+
+    def record(self, name, seconds, error=None):
+        self.latencies[name].append(seconds)
+        if error:
+            self.errors[name][error] += 1
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for name, latencies in sorted(self.latencies.items()):
+            milliseconds = np.array(latencies) * 1000
+            endpoints[name] = {
+                "count": len(latencies),
+                "errors": sum(self.errors[name].values()),
+                "error_types": dict(self.errors[name]),
+                **{f"p{q}": float(value) for q, value in zip(PERCENTILES, np.percentile(milliseconds, PERCENTILES))},
+            }
+        requests = [name for name in endpoints if not name.startswith("action ")]
+        total = sum(endpoints[name]["count"] for name in requests)
+        errors = sum(endpoints[name]["errors"] for name in requests)
+        return {
+            "elapsed": elapsed,
+            "requests": total,
+            "errors": errors,
+            "throughput": total / elapsed if elapsed else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+def split_output(output):
+    # "..a.b...c.d.." for a list of outputs, "a.b" for a single one
+    multi = output.startswith("..") and output.endswith("..")
+    parts = output[2:-2].split("...") if multi else [output]
+    return multi, [tuple(part.rsplit(".", 1)) for part in parts]
+
+
+class DashClient:
+    """The part of the Dash renderer that decides which callbacks run after a property changed."""
+
+    def __init__(self, browser, layout, dependencies):
+        self.browser = browser
+        self.values = {}
+        self.collect(layout)
+        self.callbacks = []
+        for dependency in dependencies:
+            multi, outputs = split_output(dependency["output"])
+            self.callbacks.append({
+                "output": dependency["output"],
+                "multi": multi,
+                "outputs": outputs,
+                "inputs": [(item["id"], item["property"]) for item in dependency["inputs"]],
+                "state": [(item["id"], item["property"]) for item in dependency["state"]],
+                "initial": not dependency.get("prevent_initial_call"),
+                "name": "callback " + ",".join(dict.fromkeys(component for component, _ in outputs)),
+            })
+
+    def collect(self, node):
+        if isinstance(node, list):
+            for child in node:
+                self.collect(child)
+        elif isinstance(node, dict) and isinstance(node.get("props"), dict):
+            props = node["props"]
+            if "id" in props:
+                self.values.update({(props["id"], key): value for key, value in props.items() if key != "children"})
+            self.collect(props.get("children"))
+
+    def options(self, component):
+        return [option["value"] for option in self.values.get((component, "options")) or []]
+
+    async def start(self):
+        await self.run({index: set() for index, callback in enumerate(self.callbacks) if callback["initial"]})
+
+    async def change(self, component, prop, value):
+        self.values[(component, prop)] = value
+        await self.run(self.triggered({(component, prop)}))
+
+    def triggered(self, changed):
+        return {
+            index: set(callback["inputs"]) & changed
+            for index, callback in enumerate(self.callbacks)
+            if changed.intersection(callback["inputs"])
+        }
+
+    async def run(self, pending):
+        # Callbacks reading an output of another pending callback wait for it, the others run in parallel
+        while pending:
+            outputs = {index: set(self.callbacks[index]["outputs"]) for index in pending}
+            ready = [
+                index for index in pending
+                if not any(outputs[other] & set(self.callbacks[index]["inputs"]) for other in pending if other != index)
+            ] or list(pending)
+            changed_sets = await asyncio.gather(*(self.call(index, pending.pop(index)) for index in ready))
+            for index, props in self.triggered(set().union(*changed_sets)).items():
+                pending.setdefault(index, set()).update(props)
+
+    async def call(self, index, changed):
+        callback = self.callbacks[index]
+
+        def values(props):
+            return [
+                {"id": component, "property": prop, **({"value": self.values[(component, prop)]}
+                                                       if (component, prop) in self.values else {})}
+                for component, prop in props
+            ]
+
+        outputs = [{"id": component, "property": prop} for component, prop in callback["outputs"]]
+        body = {
+            "output": callback["output"],
+            "outputs": outputs if callback["multi"] else outputs[0],
+            "inputs": values(callback["inputs"]),
+            "state": values(callback["state"]),
+            "changedPropIds": [f"{component}.{prop}" for component, prop in changed],
+        }
+        try:
+            status, content = await self.browser.request(
+                callback["name"], "POST", DASH_APP + "_dash-update-component", json.dumps(body).encode()
+            )
+        except RequestFailed:
+            return set()
+        if status == 204:  # PreventUpdate
+            return set()
+        updated = set()
+        for component, props in json.loads(content).get("response", {}).items():
+            for prop, value in props.items():
+                self.values[(component, prop)] = value
+                updated.add((component, prop))
+        return updated
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate visitors clicking through the StationsMap dashboard and report throughput, latency "
+        "percentiles and error rates. Run it once against every deployment to compare, e.g. "
+        "'gunicorn cdk1_2Da.wsgi' and 'daphne cdk1_2Da.asgi:application', with --output and then --compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of the deployment under test")
+        parser.add_argument("--users", type=int, default=10, help="Simultaneous visitors")
+        parser.add_argument("--duration", type=float, default=60, help="Seconds")
+        parser.add_argument("--ramp-up", type=float, default=10, help="Seconds until all visitors are there")
+        parser.add_argument("--think-ms", type=float, default=2000, help="Mean pause between two actions")
+        parser.add_argument("--actions", type=int, default=10, help="Mean number of actions per visit")
+        parser.add_argument("--timeout", type=float, default=30, help="Seconds until a request counts as failed")
+        parser.add_argument("--label", help="Name of the deployment in the report, e.g. wsgi or asgi")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Also write the report to this JSON file")
+        parser.add_argument("--compare", nargs="+", metavar="REPORT", help="Only compare saved JSON reports")
+
+    def handle(self, *args, **options):
+        if options["compare"]:
+            reports = []
+            for path in options["compare"]:
+                try:
+                    with open(path) as f:
+                        reports.append(json.load(f))
+                except (OSError, ValueError) as e:
+                    raise CommandError(f"Cannot read report {path}: {e}")
+            self.compare(reports)
+            return
+
+        url = urlsplit(options["url"])
+        if url.scheme != "http" or not url.hostname:
+            raise CommandError("--url must be a plain http:// URL")
+        self.host, self.port = url.hostname, url.port or 80
+        self.options = options
+        self.stats = Stats()
+        report = asyncio.run(self.run())
+        report.update({
+            "label": options["label"] or options["url"],
+            "url": options["url"],
+            "users": options["users"],
+            "duration": options["duration"],
+            "think_ms": options["think_ms"],
+        })
+        self.print_report(report)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+
+    async def run(self):
+        probe = Browser(self.host, self.port, self.options["timeout"], Stats())
+        try:
+            await probe.request("probe", "GET", "/klimadaten/")
+        except RequestFailed as e:
+            raise CommandError(f"{self.options['url']}/klimadaten/ does not answer: {e.__cause__!r}")
+        finally:
+            probe.close()
+
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.options["duration"]
+        await asyncio.gather(*(self.visitor(number, deadline) for number in range(self.options["users"])))
+        return self.stats.summary(time.perf_counter() - started)
+
+    async def visitor(self, number, deadline):
+        rng = random.Random(self.options["seed"] * 100003 + number)
+        await asyncio.sleep(self.options["ramp_up"] * number / max(self.options["users"], 1))
+        while time.monotonic() < deadline:
+            browser = Browser(self.host, self.port, self.options["timeout"], self.stats)
+            try:
+                await self.visit(browser, rng, deadline)
+            except RequestFailed:
+                await asyncio.sleep(self.think(rng))
+            finally:
+                browser.close()
+
+    def think(self, rng):
+        return rng.expovariate(1000 / self.options["think_ms"]) if self.options["think_ms"] else 0
+
+    async def visit(self, browser, rng, deadline):
+        """Open the dashboard like a browser, then click around for a while."""
+        started = time.perf_counter()
+        await browser.request("GET /klimadaten/", "GET", "/klimadaten/")
+        await browser.request("GET dash app", "GET", DASH_APP)
+        _, layout = await browser.request("GET _dash-layout", "GET", DASH_APP + "_dash-layout")
+        _, dependencies = await browser.request("GET _dash-dependencies", "GET", DASH_APP + "_dash-dependencies")
+        dash = DashClient(browser, json.loads(layout), json.loads(dependencies))
+        await dash.start()
+        self.stats.record("action open dashboard", time.perf_counter() - started)
+
+        cities = dash.options("city-dropdown")
+        # The same few cities are popular for every visitor (Zipf)
+        random.Random(self.options["seed"]).shuffle(cities)
+        popularity = np.cumsum(1 / np.arange(1, len(cities) + 1)).tolist()
+
+        for _ in range(max(1, round(rng.expovariate(1 / self.options["actions"])))):
+            await asyncio.sleep(self.think(rng))
+            if time.monotonic() >= deadline:
+                break
+            action = rng.choices(list(ACTIONS), weights=list(ACTIONS.values()))[0]
+            started = time.perf_counter()
+            if action == "click_map" and cities:
+                city_id = rng.choices(cities, cum_weights=popularity)[0]
+                await dash.change("station-map", "clickData", {"points": [{"customdata": city_id}]})
+            elif action == "page":
+                path = rng.choice(PAGES)
+                if path.endswith("stations"):
+                    path += "?country=" + rng.choice(["Switzerland", "Germany", "Austria", "France", "Italy"])
+                try:
+                    await browser.request(f"GET {path.split('?')[0]}", "GET", path)
+                except RequestFailed:
+                    pass
+            elif action in DROPDOWNS:
+                component = DROPDOWNS[action]
+                current = dash.values.get((component, "value"))
+                choices = [value for value in dash.options(component) if value != current]
+                if not choices:
+                    continue
+                await dash.change(component, "value", rng.choice(choices))
+            self.stats.record(f"action {action}", time.perf_counter() - started)
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"{report['label']}: {report['users']} users, {report['requests']} requests in "
+            f"{report['elapsed']:.1f}s, {report['throughput']:.1f} requests/s, {report['errors']} errors "
+            f"({100 * report['errors'] / max(report['requests'], 1):.1f}%)"
+        )
+        self.stdout.write(
+            f"{'endpoint':<48}{'count':>7}{'errors':>8}{'err %':>7}" + "".join(f"{f'p{q} ms':>9}" for q in PERCENTILES)
+        )
+        for name, endpoint in report["endpoints"].items():
+            style = self.style.WARNING if endpoint["errors"] else (lambda text: text)
+            self.stdout.write(style(
+                f"{name[:47]:<48}{endpoint['count']:>7}{endpoint['errors']:>8}"
+                f"{100 * endpoint['errors'] / endpoint['count']:>7.1f}"
+                + "".join(f"{endpoint[f'p{q}']:>9.0f}" for q in PERCENTILES)
+            ))
+            for error, count in endpoint["error_types"].items():
+                self.stdout.write(f"    {count} x {error}")
+
+    def compare(self, reports):
+        labels = [report["label"] for report in reports]
+        width = max(8, *map(len, labels)) + 2
+        self.stdout.write(f"{'':<48}" + "".join(f"{label:>{width}}" for label in labels))
+        self.stdout.write(f"{'users':<48}" + "".join(f"{report['users']:>{width}}" for report in reports))
+        self.stdout.write(
+            f"{'requests/s':<48}" + "".join(f"{report['throughput']:>{width}.1f}" for report in reports)
+        )
+        self.stdout.write(
+            f"{'error %':<48}"
+            + "".join(f"{100 * report['errors'] / max(report['requests'], 1):>{width}.1f}" for report in reports)
+        )
+        names = dict.fromkeys(name for report in reports for name in report["endpoints"])
+        for name in names:
+            for q in PERCENTILES:
+                cells = [report["endpoints"].get(name, {}).get(f"p{q}") for report in reports]
+                self.stdout.write(
+                    f"{f'{name[:40]} p{q} ms':<48}"
+                    + "".join(f"{'-' if cell is None else f'{cell:.0f}':>{width}}" for cell in cells)
+                )
@@ -1,39 +1,185 @@
-from datetime import datetime
+import glob
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
-from scipy.spatial import cKDTree
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
-from klimadaten.models import City, Weather
-from pathlib import Path
+from klimadaten import grid_store
+
+CSV_SUFFIXES = {".csv", ".txt"}
+NETCDF_SUFFIXES = {".nc", ".nc4"}
+
+
+def init_worker(settings_module):
+    # Needed when the pool uses "spawn" (Windows, macOS), forked workers are already set up
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    if not settings.configured:
+        django.setup()
+
+
+def ingest_csv(path, variable, chunksize):
+    day, dropped = grid_store.import_csv(path, variable, chunksize=chunksize)
+    return [(day, dropped)]
+
+
+def open_netcdf(path):
+    # Both are optional, they are only needed for NetCDF input and are not in requirements.txt
+    try:
+        import netCDF4  # noqa: F401, the engine xarray uses for the NetCDF4/HDF5 files of E-OBS
+        import xarray as xr
+    except ImportError:
+        raise CommandError("Loading NetCDF files requires xarray and netCDF4 to be installed.")
+    return xr.open_dataset(path, engine="netcdf4")
+
+
+def netcdf_coordinate_names(ds):
+    lat_name = "latitude" if "latitude" in ds.coords else "lat"
+    lon_name = "longitude" if "longitude" in ds.coords else "lon"
+    return lat_name, lon_name
+
+
+def ingest_netcdf(path, variable, nc_variable, start, stop, force):
+    written = []
+    with open_netcdf(path) as ds:
+        lat_name, lon_name = netcdf_coordinate_names(ds)
+        lat, lon = np.meshgrid(ds[lat_name].values, ds[lon_name].values, indexing="ij")
+        lat, lon = lat.ravel(), lon.ravel()
+        # Only one block of days is held in memory per worker, in the order of the lat/lon meshgrid
+        block = ds[nc_variable].isel(time=slice(start, stop)).transpose("time", lat_name, lon_name).load()
+        for index, time in enumerate(block["time"].values):
+            day = pd.Timestamp(time).date()
+            if not force and grid_store.has_day(day, variable):
+                continue
+            values = block.isel(time=index).values.ravel()
+            written.append((day, grid_store.write_day(day, lat, lon, values, variable)))
+    return written
 
 
 class Command(BaseCommand):
-    help = "Load wind speed data from CSV files into the database"
+    help = "Load daily gridded wind data (ECA&D/E-OBS CSV or NetCDF files) into the grid store"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths",
+            nargs="*",
+            help="Files, directories or glob patterns. Defaults to klimadaten/data/wws19791205.csv",
+        )
+        parser.add_argument("--variable", default=grid_store.DEFAULT_VARIABLE, help="Column name in the CSV files")
+        parser.add_argument(
+            "--netcdf-variable", default="fx", help="Variable name in NetCDF files (E-OBS uses 'fx')"
+        )
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+        parser.add_argument("--chunksize", type=int, default=100_000, help="CSV rows read at once")
+        parser.add_argument("--chunk-days", type=int, default=31, help="NetCDF days read at once")
+        parser.add_argument("--force", action="store_true", help="Overwrite days that are already stored")
 
     def handle(self, *args, **options):
-        file_path = settings.BASE_DIR / "klimadaten" / "data" / "wws19791205.csv"
-        date_str = Path(file_path).stem[3:]
-        date = datetime.strptime(date_str, "%Y%m%d").date()
-
-        df_wind = pd.read_csv(file_path)
-
-        cities = City.objects.all().values_list("id", "lat", "lon")
-        df_cities = pd.DataFrame(cities, columns=["id", "lat", "lon"])
-        city_coords = list(zip(df_cities["lat"], df_cities["lon"]))
-        wind_coords = list(zip(df_wind["lat"], df_wind["lon"]))
-
-        tree = cKDTree(city_coords)
-        distances, indices = tree.query(wind_coords, k=1)
-
-        for idx, city_idx in enumerate(indices):
-            city_id = df_cities.iloc[city_idx]["id"]
-            city = City.objects.get(id=city_id)
-            Weather.objects.update_or_create(
-                city=city,
-                date=date,
-                defaults={"max_windspeed": df_wind.iloc[idx]["FX"]},
-            )
+        paths = self.collect_paths(options["paths"])
+        if not paths:
+            raise CommandError("No input files found.")
+
+        csv_paths = []
+        for path in paths:
+            if path.suffix not in CSV_SUFFIXES:
+                continue
+            # Daily grid files carry their date in the name, e.g. station lists in the same directory do not
+            if grid_store.DATE_PATTERN.search(path.stem):
+                csv_paths.append(path)
+            else:
+                self.stdout.write(self.style.WARNING(f"Skipping {path}: no date in the file name"))
+        netcdf_paths = [path for path in paths if path.suffix in NETCDF_SUFFIXES]
+        variable = options["variable"]
+
+        tasks = []
+        skipped = 0
+        for path in csv_paths:
+            # Resume: days that were written completely before are skipped
+            if not options["force"] and grid_store.has_day(grid_store.date_from_filename(path), variable):
+                skipped += 1
+                continue
+            tasks.append((ingest_csv, path, variable, options["chunksize"]))
+        for path in netcdf_paths:
+            tasks.extend(self.netcdf_tasks(path, variable, options))
 
+        # The coordinate index has to exist before the workers write in parallel
+        if grid_store.load_coords() is None:
+            if csv_paths:
+                grid_store.ensure_coords_from_csv(csv_paths[0])
+            elif netcdf_paths:
+                self.create_coords_from_netcdf(netcdf_paths[0], options["netcdf_variable"], options["chunk_days"])
+
+        if not tasks and not skipped:
+            raise CommandError("No input files found.")
+        self.stdout.write(f"{len(tasks)} tasks, {skipped} files already loaded.")
+        written = self.run(tasks, options["workers"])
         self.stdout.write(
-            self.style.SUCCESS(f"Successfully loaded wind data for {date}.")
+            self.style.SUCCESS(f"Successfully loaded wind data for {written} days into {grid_store.store_dir()}.")
         )
+
+    def collect_paths(self, patterns):
+        if not patterns:
+            return [settings.BASE_DIR / "klimadaten" / "data" / "wws19791205.csv"]
+        paths = []
+        for pattern in patterns:
+            if Path(pattern).is_dir():
+                candidates = sorted(Path(pattern).iterdir())
+            else:
+                candidates = [Path(match) for match in sorted(glob.glob(pattern))]
+            paths.extend(
+                path for path in candidates if path.suffix in CSV_SUFFIXES | NETCDF_SUFFIXES
+            )
+        return paths
+
+    def netcdf_tasks(self, path, variable, options):
+        with open_netcdf(path) as ds:
+            days = len(ds["time"])
+        return [
+            (ingest_netcdf, path, variable, options["netcdf_variable"], start,
+             min(start + options["chunk_days"], days), options["force"])
+            for start in range(0, days, options["chunk_days"])
+        ]
+
+    def create_coords_from_netcdf(self, path, nc_variable, chunk_days):
+        with open_netcdf(path) as ds:
+            lat_name, lon_name = netcdf_coordinate_names(ds)
+            lat, lon = np.meshgrid(ds[lat_name].values, ds[lon_name].values, indexing="ij")
+            # Keep only grid points with data on any day (E-OBS is NaN over sea), one block of days at a time
+            valid = np.zeros(lat.shape, dtype=bool)
+            for start in range(0, len(ds["time"]), chunk_days):
+                block = ds[nc_variable].isel(time=slice(start, start + chunk_days))
+                valid |= np.isfinite(block.transpose("time", lat_name, lon_name).values).any(axis=0)
+            grid_store.write_coords(lat[valid], lon[valid])
+
+    def run(self, tasks, workers):
+        written = 0
+        pending = set()
+        task_iter = iter(tasks)
+        workers = max(workers or 1, 1)
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_worker,
+            initargs=(os.environ.get("DJANGO_SETTINGS_MODULE", "cdk1_2Da.settings"),),
+        ) as executor:
+            while True:
+                # Only a bounded number of tasks is queued so memory stays flat for huge inputs
+                while len(pending) < 2 * workers:
+                    task = next(task_iter, None)
+                    if task is None:
+                        break
+                    pending.add(executor.submit(*task))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for day, dropped in future.result():
+                        written += 1
+                        message = f"{day}"
+                        if dropped:
+                            message += f" ({dropped} points outside the coordinate index)"
+                        self.stdout.write(message)
+        return written
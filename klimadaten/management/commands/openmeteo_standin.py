@@ -0,0 +1,181 @@
+import json
+import random
+import re
+import struct
+import time
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import flatbuffers
+import numpy as np
+from django.core.management.base import BaseCommand
+from openmeteo_sdk.Aggregation import Aggregation
+from openmeteo_sdk.Unit import Unit
+from openmeteo_sdk.Variable import Variable
+
+AGGREGATIONS = {"max": Aggregation.maximum, "min": Aggregation.minimum, "mean": Aggregation.mean, "sum": Aggregation.sum}
+
+# Gumbel location and scale of the generated values and their unit, by variable
+CLIMATE = {
+    Variable.wind_gusts: (40.0, 12.0, Unit.kilometres_per_hour),
+    Variable.wind_speed: (20.0, 7.0, Unit.kilometres_per_hour),
+    Variable.temperature: (10.0, 6.0, Unit.celsius),
+    Variable.precipitation: (0.0, 3.0, Unit.millimetre),
+}
+DEFAULT_CLIMATE = (10.0, 3.0, Unit.undefined)
+TEMPERATURE_RANGE = 8.0  # mean difference of the daily maximum and minimum temperature
+
+UTC_OFFSET = 3600  # Europe/Berlin in winter, like the archive answers for TIMEZONE
+DAY = 24 * 60 * 60
+
+# Vtable slots of the Open-Meteo FlatBuffers schema (openmeteo_sdk only ships the readers)
+RESPONSE_SLOTS = dict(latitude=0, longitude=1, elevation=2, generation_time_ms=3, utc_offset_seconds=6, timezone=7,
+                      daily=10)
+RESPONSE_FIELDS = 15
+TIME_SLOTS = dict(time=0, time_end=1, interval=2, variables=3)
+TIME_FIELDS = 4
+VARIABLE_SLOTS = dict(variable=0, unit=1, values=3, altitude=5, aggregation=6)
+VARIABLE_FIELDS = 16
+
+
+def parse_variable(name):
+    """Split a daily variable such as ``wind_gusts_10m_max`` into variable, altitude and aggregation."""
+    match = re.fullmatch(r"(?P<name>[a-z_]+?)(?:_(?P<altitude>\d+)m)?(?:_(?P<aggregation>max|min|mean|sum))?", name)
+    variable = getattr(Variable, match["name"], None) if match else None
+    if variable is None:
+        raise ValueError(f"Cannot initialize WeatherVariable from invalid String value {name}")
+    return variable, int(match["altitude"] or 0), AGGREGATIONS.get(match["aggregation"], Aggregation.none)
+
+
+def parse_date(text):
+    # Like the archive, days past the end of the month roll over: 2023-04-31 is May 1
+    year, month, day = map(int, text.split("-"))
+    return date(year, month, 1) + timedelta(days=day - 1)
+
+
+def uniform(day, seed):
+    return np.modf(np.abs(np.sin(day * 0.1031 + seed) * 43758.5453))[0].clip(1e-6, 1 - 1e-6)
+
+
+def daily_values(variable, aggregation, latitude, longitude, start, days):
+    """Deterministic values of one location, the same day has the same value in every requested range."""
+    location, scale, _ = CLIMATE.get(variable, DEFAULT_CLIMATE)
+    day = np.arange(start.toordinal(), start.toordinal() + days, dtype=np.float64)
+    seed = (latitude * 12.9898 + longitude * 78.233 + variable * 3.7) % 1000
+    values = location + scale * -np.log(-np.log(uniform(day, seed)))
+    if variable == Variable.temperature and aggregation in (Aggregation.maximum, Aggregation.minimum):
+        # Both extremes lie around the same daily value, the minimum always below the maximum
+        spread = TEMPERATURE_RANGE / 2 * (0.5 + uniform(day, seed + aggregation))
+        values = values + spread if aggregation == Aggregation.maximum else values - spread
+    if variable == Variable.precipitation:
+        values = values.clip(0)
+    return values.astype(np.float32)
+
+
+def build_response(latitude, longitude, start, end, variables):
+    """One length-prefixed ``WeatherApiResponse`` as the archive sends it with ``format=flatbuffers``."""
+    builder = flatbuffers.Builder(1024)
+    days = (end - start).days + 1
+    start_time = int(datetime.combine(start, datetime.min.time(), timezone.utc).timestamp()) - UTC_OFFSET
+
+    tables = []
+    for name in variables:
+        variable, altitude, aggregation = parse_variable(name)
+        unit = CLIMATE.get(variable, DEFAULT_CLIMATE)[2]
+        values = builder.CreateNumpyVector(daily_values(variable, aggregation, latitude, longitude, start, days))
+        builder.StartObject(VARIABLE_FIELDS)
+        builder.PrependUOffsetTRelativeSlot(VARIABLE_SLOTS["values"], values, 0)
+        builder.PrependInt16Slot(VARIABLE_SLOTS["altitude"], altitude, 0)
+        builder.PrependUint8Slot(VARIABLE_SLOTS["variable"], variable, 0)
+        builder.PrependUint8Slot(VARIABLE_SLOTS["unit"], unit, 0)
+        builder.PrependUint8Slot(VARIABLE_SLOTS["aggregation"], aggregation, 0)
+        tables.append(builder.EndObject())
+
+    builder.StartVector(4, len(tables), 4)
+    for table in reversed(tables):
+        builder.PrependUOffsetTRelative(table)
+    vector = builder.EndVector()
+
+    builder.StartObject(TIME_FIELDS)
+    builder.PrependInt64Slot(TIME_SLOTS["time"], start_time, 0)
+    builder.PrependInt64Slot(TIME_SLOTS["time_end"], start_time + days * DAY, 0)
+    builder.PrependUOffsetTRelativeSlot(TIME_SLOTS["variables"], vector, 0)
+    builder.PrependInt32Slot(TIME_SLOTS["interval"], DAY, 0)
+    daily = builder.EndObject()
+
+    zone = builder.CreateString("Europe/Berlin")
+    builder.StartObject(RESPONSE_FIELDS)
+    builder.PrependUOffsetTRelativeSlot(RESPONSE_SLOTS["daily"], daily, 0)
+    builder.PrependUOffsetTRelativeSlot(RESPONSE_SLOTS["timezone"], zone, 0)
+    builder.PrependFloat32Slot(RESPONSE_SLOTS["latitude"], latitude, 0)
+    builder.PrependFloat32Slot(RESPONSE_SLOTS["longitude"], longitude, 0)
+    builder.PrependFloat32Slot(RESPONSE_SLOTS["elevation"], 0, 0)
+    builder.PrependFloat32Slot(RESPONSE_SLOTS["generation_time_ms"], 0.5, 0)
+    builder.PrependInt32Slot(RESPONSE_SLOTS["utc_offset_seconds"], UTC_OFFSET, 0)
+    builder.Finish(builder.EndObject())
+    message = builder.Output()
+    return struct.pack("<I", len(message)) + message
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    error_rate = 0.0
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            return self.reply(502, b"Bad Gateway", "text/plain")
+        url = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            body = build_response(
+                float(query["latitude"]),
+                float(query["longitude"]),
+                parse_date(query["start_date"]),
+                parse_date(query["end_date"]),
+                query.get("daily", "").split(","),
+            )
+        except (KeyError, ValueError) as e:
+            # The archive answers invalid parameters with 400 and a JSON reason
+            reason = f"Parameter {e} is missing" if isinstance(e, KeyError) else str(e)
+            return self.reply(400, json.dumps({"error": True, "reason": reason}).encode(), "application/json")
+        self.reply(200, body, "application/octet-stream")
+
+    def reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve generated daily data in the format of the Open-Meteo archive API, for load tests without "
+        "network access. Point OPEN_METEO_ARCHIVE_URL at http://<host>:<port>/v1/archive"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8090)
+        parser.add_argument("--latency-ms", type=float, default=100, help="Added to every response")
+        parser.add_argument("--error-rate", type=float, default=0, help="Share of requests answered with 502")
+
+    def handle(self, *args, **options):
+        handler = type("Handler", (ArchiveHandler,), {
+            "latency": options["latency_ms"] / 1000,
+            "error_rate": options["error_rate"],
+        })
+        server = ThreadingHTTPServer((options["host"], options["port"]), handler)
+        self.stdout.write(f"Open-Meteo stand-in on http://{options['host']}:{options['port']}/v1/archive")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,154 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from klimadaten import city_table, openmeteo, series_store, views
+from klimadaten.dash_apps.finished_apps import stations_map
+from klimadaten.page_cache import call_key, page_key
+from klimadaten.warmup import (
+    DEFAULT_CITIES,
+    DEFAULT_MONTH,
+    DEFAULT_WINDSPEED,
+    DEFAULT_YEAR,
+    dashboard_ranges,
+    last_year_range,
+)
+
+# Only caches shared by all processes, the in-process ones are warmed by every worker (klimadaten/warmup.py)
+TIERS = ["series", "http", "figures"]
+
+PAGES = [
+    (views.map_stations, "/klimadaten/"),
+    (views.datastory, "/klimadaten/Datastory"),
+    (views.stations, "/klimadaten/stations"),
+]
+
+
+class Command(BaseCommand):
+    help = "Warm the shared caches (series store, HTTP cache, figures in Redis) for popular cities"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--city", type=int, action="append", help="City id, defaults to Sumba and Brugg (1756121125)"
+        )
+        parser.add_argument("--year", type=int, default=DEFAULT_YEAR)
+        parser.add_argument("--month", default=DEFAULT_MONTH, help="Two digits, e.g. 04")
+        parser.add_argument("--windspeed", type=int, default=DEFAULT_WINDSPEED)
+        parser.add_argument("--tier", choices=TIERS, action="append", help="Defaults to all tiers")
+        parser.add_argument("--workers", type=int, default=4, help="Requests running at the same time")
+
+    def handle(self, *args, **options):
+        cities = city_table.current()
+        city_ids = options["city"] or DEFAULT_CITIES
+        unknown = [city_id for city_id in city_ids if cities.index(city_id) is None]
+        if unknown:
+            raise CommandError(f"Unknown city ids: {', '.join(map(str, unknown))}")
+        self.cities = cities
+        self.city_ids = city_ids
+        self.options = options
+
+        total = time.perf_counter()
+        missing = 0
+        for tier in options["tier"] or TIERS:
+            tasks = getattr(self, f"{tier}_tasks")()
+            missing += self.run(tier, tasks, options["workers"])
+        style = self.style.SUCCESS if not missing else self.style.WARNING
+        self.stdout.write(style(
+            f"Warmed {len(city_ids)} cities in {time.perf_counter() - total:.1f}s, {missing} entries missing."
+        ))
+
+    def run(self, tier, tasks, workers):
+        """Run ``(description, callable)`` tasks with at most ``workers`` at a time, returns the number missing."""
+        started = time.perf_counter()
+        done, failed = 0, []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(task): description for description, task in tasks}
+            for future in as_completed(futures):
+                try:
+                    ok = future.result() is not False
+                except Exception as e:
+                    ok = False
+                    futures[future] = f"{futures[future]} ({type(e).__name__}: {str(e)[:100]})"
+                if ok:
+                    done += 1
+                else:
+                    failed.append(futures[future])
+        style = self.style.SUCCESS if not failed else self.style.WARNING
+        self.stdout.write(
+            style(f"{tier:<8}{done:>5}/{len(tasks):<5} warm in {time.perf_counter() - started:6.1f}s")
+        )
+        for description in failed:
+            self.stdout.write(f"    missing: {description}")
+        return len(failed)
+
+    def series_tasks(self):
+        # Whole series in the local store on disk
+        start, end = series_store.SERIES_START, series_store.last_available_day()
+        return [
+            (f"{name} series store", lambda city=city: self.ensure_series(city, start, end))
+            for city, name in self.selected_cities()
+        ]
+
+    def http_tasks(self):
+        # Open-Meteo responses in the requests_cache database, shared by all processes.
+        # The selected city asks with float, the comparison city with the stored decimal coordinates.
+        locations = {}
+        for stored_coordinates in (False, True):
+            for city, name in self.selected_cities(stored_coordinates):
+                locations.setdefault((str(city["lat"]), str(city["lon"])), (city, name))
+        return [
+            (f"{name} {start}..{end}", lambda city=city, start=start, end=end: openmeteo.fetch_daily(city, start, end))
+            for city, name in locations.values()
+            for start, end in dashboard_ranges(self.options["year"])
+        ]
+
+    def figures_tasks(self):
+        # Figures of the default selections and the pages, stored in the Django cache (Redis)
+        year, month, windspeed = self.options["year"], self.options["month"], self.options["windspeed"]
+        first, last = last_year_range()
+        calls = []
+        for city, name in self.selected_cities():
+            calls.append((f"{name} last year", stations_map.city_plots, (city, windspeed, first, last)))
+            for other_id in self.city_ids:
+                calls += [
+                    (
+                        f"{name} yearly comparison",
+                        stations_map.yearly_comparison_plot,
+                        (other_id, year, city["id"], self.cities.key),
+                    ),
+                    (
+                        f"{name} monthly comparison",
+                        stations_map.monthly_comparison_plot,
+                        (other_id, month, city["id"], windspeed, self.cities.key),
+                    ),
+                ]
+        tasks = [
+            (description, lambda function=function, args=args: self.stored(
+                lambda: function(*args), call_key(function, args, {})
+            ))
+            for description, function, args in calls
+        ]
+        factory = RequestFactory()
+        for view, path in PAGES:
+            request = factory.get(path)
+            tasks.append((f"page {path}", lambda view=view, request=request: self.stored(
+                lambda: view(request), page_key(request, view.tables)
+            )))
+        return tasks
+
+    def stored(self, build, key):
+        # The cache ignores errors (IGNORE_EXCEPTIONS), so only reading the value back shows it was stored
+        build()
+        return cache.get(key) is not None
+
+    def selected_cities(self, stored_coordinates=False):
+        for city_id in self.city_ids:
+            city = self.cities.city(city_id, stored_coordinates)
+            yield city, f"{city['name']} ({city['iso2']})"
+
+    def ensure_series(self, city, start, end):
+        series_store.ensure_series(SimpleNamespace(**city), start, end)
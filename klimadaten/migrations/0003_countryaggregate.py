@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:19
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Avg, Count, Max, Min
+
+
+def build_aggregates(apps, schema_editor):
+    Station = apps.get_model("klimadaten", "Station")
+    CountryAggregate = apps.get_model("klimadaten", "CountryAggregate")
+    rows = (
+        Station.objects.values("country")
+        .annotate(
+            station_count=Count("staid"),
+            elevation_min=Min("elevation"),
+            elevation_max=Max("elevation"),
+            elevation_mean=Avg("elevation"),
+            lat_min=Min("lat"),
+            lat_max=Max("lat"),
+            lon_min=Min("lon"),
+            lon_max=Max("lon"),
+            lat_centroid=Avg("lat"),
+            lon_centroid=Avg("lon"),
+        )
+        .order_by()
+    )
+    for row in rows:
+        row["elevation_mean"] = Decimal(row["elevation_mean"]).quantize(Decimal("0.01"))
+        row["lat_centroid"] = Decimal(row["lat_centroid"]).quantize(Decimal("0.000001"))
+        row["lon_centroid"] = Decimal(row["lon_centroid"]).quantize(Decimal("0.000001"))
+        CountryAggregate.objects.create(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("klimadaten", "0002_tableversion"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CountryAggregate",
+            fields=[
+                ("country", models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ("station_count", models.PositiveIntegerField(default=0)),
+                ("elevation_min", models.DecimalField(decimal_places=2, max_digits=9, null=True)),
+                ("elevation_max", models.DecimalField(decimal_places=2, max_digits=9, null=True)),
+                ("elevation_mean", models.DecimalField(decimal_places=2, max_digits=9, null=True)),
+                ("lat_min", models.DecimalField(decimal_places=6, max_digits=9, null=True)),
+                ("lat_max", models.DecimalField(decimal_places=6, max_digits=9, null=True)),
+                ("lon_min", models.DecimalField(decimal_places=6, max_digits=9, null=True)),
+                ("lon_max", models.DecimalField(decimal_places=6, max_digits=9, null=True)),
+                ("lat_centroid", models.DecimalField(decimal_places=6, max_digits=9, null=True)),
+                ("lon_centroid", models.DecimalField(decimal_places=6, max_digits=9, null=True)),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(build_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("klimadaten", "0003_countryaggregate"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="city",
+            name="elevation",
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=9, null=True),
+        ),
+        migrations.CreateModel(
+            name="CityStation",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("rank", models.PositiveSmallIntegerField()),
+                ("distance_km", models.FloatField()),
+                ("elevation_diff", models.DecimalField(decimal_places=2, max_digits=9, null=True)),
+                ("city", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="station_links", to="klimadaten.city")),
+                ("station", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="city_links", to="klimadaten.station")),
+            ],
+            options={
+                "ordering": ["city", "rank"],
+            },
+        ),
+        migrations.AddField(
+            model_name="city",
+            name="stations",
+            field=models.ManyToManyField(related_name="cities", through="klimadaten.CityStation", to="klimadaten.station"),
+        ),
+        migrations.AddConstraint(
+            model_name="citystation",
+            constraint=models.UniqueConstraint(fields=("city", "station"), name="unique_city_station"),
+        ),
+    ]
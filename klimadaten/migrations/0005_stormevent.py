@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("klimadaten", "0004_citystation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StormEvent",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("start", models.DateField()),
+                ("end", models.DateField()),
+                ("duration_days", models.PositiveSmallIntegerField()),
+                ("footprint", models.PositiveIntegerField()),
+                ("peak_gust", models.FloatField()),
+                ("peak_day", models.DateField()),
+                ("lat", models.DecimalField(decimal_places=6, max_digits=9)),
+                ("lon", models.DecimalField(decimal_places=6, max_digits=9)),
+                ("peak_city", models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name="storm_peaks", to="klimadaten.city")),
+            ],
+            options={
+                "ordering": ["start"],
+                "indexes": [models.Index(fields=["start", "end"], name="klimadaten__start_aaf194_idx")],
+            },
+        ),
+    ]
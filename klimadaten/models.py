@@ -1,4 +1,9 @@
-from django.db import models
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, router
+from django.utils import timezone
+
+from cdk1_2Da.routers import use_primary
 
 
 class Station(models.Model):
@@ -21,7 +26,141 @@ class City(models.Model):
     iso3 = models.CharField(max_length=3)
     lat = models.DecimalField(max_digits=9, decimal_places=6)
     lon = models.DecimalField(max_digits=9, decimal_places=6)
+    # Not part of worldcities.csv, set where it is known
+    elevation = models.DecimalField(max_digits=9, decimal_places=2, null=True, blank=True)
+    stations = models.ManyToManyField(Station, through="CityStation", related_name="cities")
 
     def __str__(self):
         return f"{self.name} in {self.country}"
 
+
+class CityStation(models.Model):
+    """The k nearest stations of a city, see klimadaten/neighbours.py."""
+
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name="station_links")
+    station = models.ForeignKey(Station, on_delete=models.CASCADE, related_name="city_links")
+    rank = models.PositiveSmallIntegerField()
+    distance_km = models.FloatField()
+    # Station elevation minus city elevation, empty while the city elevation is unknown
+    elevation_diff = models.DecimalField(max_digits=9, decimal_places=2, null=True)
+
+    class Meta:
+        ordering = ["city", "rank"]
+        constraints = [
+            models.UniqueConstraint(fields=["city", "station"], name="unique_city_station"),
+        ]
+
+    def __str__(self):
+        return f"{self.city} -> {self.station} ({self.distance_km:.1f} km)"
+
+
+class TableVersion(models.Model):
+    """Version counter per table, bumped whenever its rows change."""
+
+    table = models.CharField(max_length=50, primary_key=True)
+    version = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    # The versions are mirrored in the cache so hot pages can check them without a query
+    CACHE_TIMEOUT = 60 * 60
+
+    @staticmethod
+    def cache_key(table):
+        return f"table-version:{table}"
+
+    @classmethod
+    def current(cls, table):
+        return cls.versions(table)[table]
+
+    @classmethod
+    def versions(cls, *tables):
+        """Return ``{table: version}``, from the cache where possible."""
+        cached = cache.get_many([cls.cache_key(table) for table in tables])
+        versions = {table: cached.get(cls.cache_key(table)) for table in tables}
+        missing = [table for table, version in versions.items() if version is None]
+        if missing:
+            # From the primary, a lagging replica would put old versions into the cache keys
+            with use_primary():
+                stored = dict(cls.objects.filter(table__in=missing).values_list("table", "version"))
+            for table in missing:
+                versions[table] = stored.get(table, 0)
+            cache.set_many({cls.cache_key(table): versions[table] for table in missing}, cls.CACHE_TIMEOUT)
+        return versions
+
+    @classmethod
+    def bump(cls, table):
+        db = router.db_for_write(cls)
+        if not cls.objects.filter(table=table).update(version=models.F("version") + 1, updated=timezone.now()):
+            cls.objects.get_or_create(table=table, defaults={"version": 1})
+        # Read back from the primary, a replica may not have the new version yet
+        version = cls.objects.using(db).get(table=table).version
+        cache.set(cls.cache_key(table), version, cls.CACHE_TIMEOUT)
+
+    def __str__(self):
+        return f"{self.table} v{self.version}"
+
+
+class CountryAggregate(models.Model):
+    """Precomputed station statistics per country, see klimadaten/aggregates.py."""
+
+    country = models.CharField(max_length=255, primary_key=True)
+    station_count = models.PositiveIntegerField(default=0)
+    elevation_min = models.DecimalField(max_digits=9, decimal_places=2, null=True)
+    elevation_max = models.DecimalField(max_digits=9, decimal_places=2, null=True)
+    elevation_mean = models.DecimalField(max_digits=9, decimal_places=2, null=True)
+    lat_min = models.DecimalField(max_digits=9, decimal_places=6, null=True)
+    lat_max = models.DecimalField(max_digits=9, decimal_places=6, null=True)
+    lon_min = models.DecimalField(max_digits=9, decimal_places=6, null=True)
+    lon_max = models.DecimalField(max_digits=9, decimal_places=6, null=True)
+    lat_centroid = models.DecimalField(max_digits=9, decimal_places=6, null=True)
+    lon_centroid = models.DecimalField(max_digits=9, decimal_places=6, null=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.country}: {self.station_count} stations"
+
+
+class StormEvent(models.Model):
+    """Storm found in the city series by klimadaten/storms.py."""
+
+    start = models.DateField()
+    end = models.DateField()
+    duration_days = models.PositiveSmallIntegerField()
+    footprint = models.PositiveIntegerField()  # number of cities above Beaufort 9
+    peak_gust = models.FloatField()
+    peak_day = models.DateField()
+    peak_city = models.ForeignKey(City, on_delete=models.SET_NULL, null=True, related_name="storm_peaks")
+    lat = models.DecimalField(max_digits=9, decimal_places=6)  # centroid of the footprint
+    lon = models.DecimalField(max_digits=9, decimal_places=6)
+
+    class Meta:
+        ordering = ["start"]
+        indexes = [models.Index(fields=["start", "end"])]
+
+    def __str__(self):
+        return f"Storm {self.start} - {self.end} ({self.footprint} cities, {self.peak_gust:.0f} km/h)"
+
+
+class ProfileRecord(models.Model):
+    """Profiled request of a staff user, see klimadaten/profiling.py."""
+
+    created = models.DateTimeField(auto_now_add=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name="+")
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    label = models.CharField(max_length=200, blank=True)  # the Dash callbacks or the view
+    status = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    breakdown = models.JSONField(default=dict)  # milliseconds per package and per callback
+    top_functions = models.TextField(blank=True)
+    file = models.CharField(max_length=100)  # cProfile output in the profile directory
+    size = models.PositiveIntegerField()  # bytes
+
+    class Meta:
+        ordering = ["-created"]
+
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms:.0f} ms)"
+
+    def package_ms(self, package):
+        return self.breakdown.get("total", {}).get(package, 0)
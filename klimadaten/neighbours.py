@@ -0,0 +1,119 @@
+"""Precomputed nearest stations per city.
+
+Coordinates are converted to points on the unit sphere, so the euclidean
+distance used by the KD-tree grows with the great circle distance. The
+stored distance is the haversine distance in km.
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Max
+from scipy.spatial import cKDTree
+
+from klimadaten.models import City, CityStation, Station
+
+DEFAULT_K = 5
+EARTH_RADIUS_KM = 6371.0088
+
+
+def unit_vectors(lat, lon):
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (
+        np.radians(np.asarray(value, dtype=np.float64)) for value in (lat1, lon1, lat2, lon2)
+    )
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class StationIndex:
+    def __init__(self):
+        rows = list(Station.objects.order_by("staid").values_list("staid", "lat", "lon", "elevation"))
+        self.staids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.lat = np.array([row[1] for row in rows], dtype=np.float64)
+        self.lon = np.array([row[2] for row in rows], dtype=np.float64)
+        self.elevation = [row[3] for row in rows]
+        self.tree = cKDTree(unit_vectors(self.lat, self.lon)) if rows else None
+
+    def links(self, cities, k=DEFAULT_K):
+        """Create (unsaved) CityStation rows for ``cities``."""
+        if self.tree is None or not cities:
+            return []
+        k = min(k, len(self.staids))
+        lat = np.array([float(city.lat) for city in cities])
+        lon = np.array([float(city.lon) for city in cities])
+        _, indices = self.tree.query(unit_vectors(lat, lon), k=k)
+        indices = indices.reshape(len(cities), k)
+        distances = haversine_km(lat[:, None], lon[:, None], self.lat[indices], self.lon[indices])
+
+        links = []
+        for row, city in enumerate(cities):
+            for rank in range(k):
+                index = indices[row, rank]
+                links.append(
+                    CityStation(
+                        city_id=city.id,
+                        station_id=int(self.staids[index]),
+                        rank=rank + 1,
+                        distance_km=round(float(distances[row, rank]), 3),
+                        elevation_diff=(
+                            self.elevation[index] - city.elevation if city.elevation is not None else None
+                        ),
+                    )
+                )
+        return links
+
+
+def linked_k():
+    """The k of the stored links, so incremental relinks keep what link_stations chose.
+
+    Taken from the highest rank, ``DEFAULT_K`` while no city is linked.
+    """
+    return CityStation.objects.aggregate(k=Max("rank"))["k"] or DEFAULT_K
+
+
+def rebuild_all(k=None, batch_size=2000):
+    """Recompute the links of all cities, with the k of the current links unless ``k`` is given."""
+    k = k or linked_k()
+    index = StationIndex()
+    cities = list(City.objects.only("id", "lat", "lon", "elevation"))
+    with transaction.atomic():
+        CityStation.objects.all().delete()
+        for start in range(0, len(cities), batch_size):
+            CityStation.objects.bulk_create(index.links(cities[start:start + batch_size], k))
+    return len(cities)
+
+
+def refresh_cities(city_ids, k=None, index=None):
+    city_ids = list(city_ids)
+    if not city_ids:
+        return
+    k = k or linked_k()
+    index = index or StationIndex()
+    cities = list(City.objects.filter(id__in=city_ids).only("id", "lat", "lon", "elevation"))
+    with transaction.atomic():
+        CityStation.objects.filter(city_id__in=city_ids).delete()
+        CityStation.objects.bulk_create(index.links(cities, k))
+
+
+def cities_affected_by(station, k=None):
+    """Cities whose neighbour list can change when ``station`` is added, moved or removed."""
+    k = k or linked_k()
+    linked = set(CityStation.objects.filter(station=station).values_list("city_id", flat=True))
+    rows = list(
+        City.objects.annotate(links=Count("station_links"), farthest=Max("station_links__distance_km"))
+        .values_list("id", "lat", "lon", "links", "farthest")
+    )
+    if not rows:
+        return linked
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    lat = np.array([float(row[1]) for row in rows])
+    lon = np.array([float(row[2]) for row in rows])
+    links = np.array([row[3] for row in rows])
+    farthest = np.array([row[4] if row[4] is not None else np.inf for row in rows])
+    distance = haversine_km(lat, lon, float(station.lat), float(station.lon))
+    closer = (links < k) | (distance < farthest)
+    return linked | set(ids[closer].tolist())
@@ -0,0 +1,234 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+
+from django.conf import settings
+import numpy as np
+import pandas as pd
+import requests
+import requests_cache
+from openmeteo_sdk.WeatherApiResponse import WeatherApiResponse
+
+from klimadaten.array_cache import ArrayCache
+from klimadaten.circuit_breaker import CircuitBreaker, CircuitOpen
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_URL = getattr(settings, "OPEN_METEO_ARCHIVE_URL", "https://archive-api.open-meteo.com/v1/archive")
+DAILY_VARIABLE = "wind_gusts_10m_max"
+# Fetched together with one request per location and range, each kept as a column of its own type
+# next to the shared dates. Charts of another variable need no further request to the archive.
+DAILY_VARIABLES = {
+    "wind_gusts_10m_max": np.float32,  # km/h
+    "wind_speed_10m_max": np.float32,  # km/h
+    "temperature_2m_max": np.float32,  # °C
+    "temperature_2m_min": np.float32,  # °C
+    "precipitation_sum": np.float32,  # mm
+}
+TIMEZONE = "Europe/Berlin"
+
+# Coordinates are rounded before they are used as cache key, the archive grid is far coarser
+GRID_DECIMALS = 4
+
+_cache_settings = getattr(settings, "KLIMADATEN_ARRAY_CACHE", {})
+array_cache = ArrayCache(
+    max_bytes=_cache_settings.get("MAX_BYTES", 64 * 1024 * 1024),
+    ttl=_cache_settings.get("TTL", 24 * 60 * 60),
+)
+
+_policy = getattr(settings, "KLIMADATEN_FETCH_POLICY", {})
+# Seconds after which no new attempt is made, each attempt waits at most the rest of them per read
+DEADLINE = _policy.get("DEADLINE", 8)
+RETRY_BACKOFF = 0.2
+# Ranges ending in the last RECENT_DAYS still change (preliminary data, days the archive does not have
+# yet). They are refreshed once older than RECENT_MAX_AGE, older ranges are stored for good.
+RECENT_DAYS = _policy.get("RECENT_DAYS", 90)
+RECENT_MAX_AGE = _policy.get("RECENT_MAX_AGE", 6 * 60 * 60)
+# Recent arrays stay in memory only briefly, so a refreshed response is used soon
+RECENT_ARRAY_TTL = 10 * 60
+
+breaker = CircuitBreaker(
+    failure_threshold=_policy.get("FAILURE_THRESHOLD", 5),
+    reset_timeout=_policy.get("RESET_TIMEOUT", 30),
+)
+_refresh_executor = ThreadPoolExecutor(max_workers=_policy.get("REFRESH_WORKERS", 2))
+_refreshing = set()
+_refresh_lock = threading.Lock()
+_sessions = threading.local()
+
+
+class OpenMeteoError(Exception):
+    pass
+
+
+class UpstreamUnavailable(OpenMeteoError):
+    """The archive did not answer within the deadline or the circuit breaker is open."""
+
+
+def grid_cell(selected_station):
+    return (
+        round(float(selected_station["lat"]), GRID_DECIMALS),
+        round(float(selected_station["lon"]), GRID_DECIMALS),
+    )
+
+
+def call_open_meteo(selected_station, start_date, end_date, variables=(DAILY_VARIABLE,)):
+    """Daily values as DataFrame with a ``date`` column and one column per variable of ``variables``.
+
+    The archive is always asked for all ``DAILY_VARIABLES``, so other variables of the same range come
+    from the HTTP cache. Only the requested columns are kept in the array cache, which keeps the number
+    of ranges fitting into its byte budget.
+    """
+    key = (*grid_cell(selected_station), tuple(variables), start_date, end_date)
+    arrays = array_cache.get(key)
+    if arrays is None:
+        dates, columns = fetch_daily(selected_station, start_date, end_date)
+        arrays = (dates, *(columns[variable] for variable in variables))
+        array_cache.set(key, arrays, ttl=RECENT_ARRAY_TTL if is_recent(end_date) else None)
+    dates, *values = arrays
+
+    daily_data = {
+        "date": pd.DatetimeIndex(dates).tz_localize("UTC"),
+        **dict(zip(variables, values)),
+    }
+    daily_dataframe = pd.DataFrame(data=daily_data)
+    return daily_dataframe
+
+
+def cache_session():
+    # One session per thread, the responses are kept in .cache.sqlite
+    session = getattr(_sessions, "session", None)
+    if session is None:
+        session = _sessions.session = requests_cache.CachedSession(".cache", expire_after=-1)
+    return session
+
+
+def is_recent(end_date):
+    # ISO dates compare as strings, also the "2023-04-31" the monthly comparison asks for
+    return end_date >= (date.today() - timedelta(days=RECENT_DAYS)).isoformat()
+
+
+def age(response):
+    created_at = response.created_at
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - created_at).total_seconds()
+
+
+def fetch_daily(selected_station, start_date, end_date, variables=tuple(DAILY_VARIABLES), deadline=DEADLINE):
+    """Return the dates and a dict with the values of each of ``variables``."""
+    # The order of variables in hourly or daily is important to assign them correctly below
+    params = {
+        "latitude": selected_station["lat"],
+        "longitude": selected_station["lon"],
+        "start_date": start_date,
+        "end_date": end_date,
+        "daily": ",".join(variables),
+        "timezone": TIMEZONE,
+        "format": "flatbuffers",
+    }
+    cached = cache_session().get(ARCHIVE_URL, params=params, only_if_cached=True)
+    if cached.status_code == 200:
+        if is_recent(end_date) and age(cached) > RECENT_MAX_AGE:
+            # Stale while revalidate: answer with the stored data, the next request gets the refreshed one
+            refresh_later(params)
+        content = cached.content
+    else:
+        content = request_archive(params, deadline).content
+    return decode_daily(content, variables)
+
+
+def request_archive(params, deadline=DEADLINE):
+    """Send a request to the archive, retried until ``deadline`` seconds are over, and store the response.
+
+    No attempt starts after the deadline, and each one waits at most the
+    remaining time to connect and for every read. A response that keeps
+    trickling in can therefore take longer than ``deadline``.
+
+    Raises ``UpstreamUnavailable`` without sending anything while the circuit breaker is open.
+    """
+    try:
+        breaker.before_call()
+    except CircuitOpen as e:
+        raise UpstreamUnavailable(str(e)) from e
+
+    give_up = time.monotonic() + deadline
+    backoff = RETRY_BACKOFF
+    error = None
+    healthy = False
+    try:
+        while True:
+            remaining = give_up - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                response = cache_session().get(ARCHIVE_URL, params=params, timeout=remaining, force_refresh=True)
+            except requests.RequestException as e:
+                error = e
+            else:
+                if response.ok:
+                    healthy = True
+                    return response
+                if response.status_code == 400:
+                    # The archive works, the parameters are wrong
+                    healthy = True
+                    raise OpenMeteoError(response.text)
+                error = f"HTTP {response.status_code}"
+            time.sleep(min(backoff, max(give_up - time.monotonic(), 0)))
+            backoff *= 2
+    finally:
+        if healthy:
+            breaker.success()
+        else:
+            breaker.failure()
+    raise UpstreamUnavailable(f"No answer from the archive within {deadline}s: {error}")
+
+
+def refresh_later(params):
+    """Refresh a stored response in the background, at most once at a time."""
+    key = tuple(sorted(params.items()))
+    with _refresh_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    _refresh_executor.submit(refresh, key, params)
+
+
+def refresh(key, params):
+    try:
+        request_archive(params)
+    except Exception as e:
+        # The stored response is used until the next try
+        logger.warning("Refreshing %s..%s failed: %s", params["start_date"], params["end_date"], e)
+    finally:
+        with _refresh_lock:
+            _refreshing.discard(key)
+
+
+def decode_daily(content, variables):
+    # The body holds one length-prefixed FlatBuffers message per location, errors in the stream start
+    # with "Unexpected"
+    if content.startswith(b"Unexpected"):
+        raise OpenMeteoError(content.decode(errors="replace"))
+    response = WeatherApiResponse.GetRootAs(content, 4)
+
+    # Process daily data. The order of variables needs to be the same as requested.
+    daily = response.Daily()
+    if daily.VariablesLength() != len(variables):
+        raise OpenMeteoError(f"Asked for {len(variables)} daily variables, got {daily.VariablesLength()}")
+    # Copied out of the response, a view would keep the buffer of all variables alive in the array cache
+    columns = {
+        variable: daily.Variables(i).ValuesAsNumpy().astype(DAILY_VARIABLES.get(variable, np.float32))
+        for i, variable in enumerate(variables)
+    }
+
+    dates = pd.date_range(
+        start=pd.to_datetime(daily.Time(), unit="s"),
+        end=pd.to_datetime(daily.TimeEnd(), unit="s"),
+        freq=pd.Timedelta(seconds=daily.Interval()),
+        inclusive="left",
+    )
+    # Keep plain UTC datetime64 values, the timezone is attached again when building the DataFrame
+    return dates.values, columns
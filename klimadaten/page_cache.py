@@ -0,0 +1,119 @@
+"""Caching of rendered pages and figures in the Django cache (Redis).
+
+A page is stored under its path, its query string and the current
+``TableVersion`` of the tables it is built from. Loading data bumps the
+version, so pages of the old data are never read again and simply expire.
+
+Only one request renders a missing page. The others wait up to
+``LOCK_WAIT`` seconds for it instead of all rendering the same page at once
+(cache stampede).
+"""
+import functools
+import hashlib
+import json
+import random
+import time
+from datetime import date
+
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from klimadaten.models import TableVersion
+
+PAGE_TIMEOUT = 24 * 60 * 60
+FIGURE_TIMEOUT = 24 * 60 * 60
+LOCK_TIMEOUT = 30  # a crashed renderer blocks the key at most this long
+LOCK_WAIT = 5
+POLL_INTERVAL = 0.05
+
+
+def page_key(request, tables):
+    path = hashlib.md5(request.get_full_path().encode(), usedforsecurity=False).hexdigest()
+    versions = TableVersion.versions(*tables) if tables else {}
+    return "page:" + path + "".join(f":{table}{version}" for table, version in sorted(versions.items()))
+
+
+def get_or_build(key, build, timeout=PAGE_TIMEOUT):
+    """Return the cached value of ``key`` or store what ``build()`` returns.
+
+    ``build`` may return ``None`` for results that must not be cached.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f"lock:{key}"
+    deadline = time.monotonic() + LOCK_WAIT
+    while True:
+        acquired = cache.add(lock_key, 1, LOCK_TIMEOUT)
+        # django-redis returns None instead of raising if Redis is down
+        if acquired is None:
+            return build()
+        if acquired:
+            break
+        time.sleep(POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        if time.monotonic() > deadline:
+            return build()
+
+    try:
+        value = build()
+        if value is not None:
+            # Spread the expiry so pages cached together are not all rebuilt at once
+            cache.set(key, value, timeout + random.randint(0, timeout // 10))
+    finally:
+        cache.delete(lock_key)
+    return value
+
+
+def cached_page(*tables, timeout=PAGE_TIMEOUT):
+    """Cache successful GET responses of a view until ``tables`` change."""
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+
+            rendered = None
+
+            def build():
+                nonlocal rendered
+                rendered = view(request, *args, **kwargs)
+                if rendered.status_code != 200 or rendered.streaming or rendered.cookies:
+                    return None
+                return rendered.content, rendered["Content-Type"]
+
+            cached = get_or_build(page_key(request, tables), build, timeout)
+            if rendered is not None:
+                return rendered
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        # For page_key, e.g. to check that warm_caches stored a page
+        wrapper.tables = tables
+        return wrapper
+
+    return decorator
+
+
+def call_key(function, args, kwargs):
+    arguments = json.dumps([args, kwargs], sort_keys=True, default=str)
+    digest = hashlib.md5(arguments.encode(), usedforsecurity=False).hexdigest()
+    # Plots of "the last year" move on every day
+    return f"call:{function.__module__}.{function.__qualname__}:{digest}:{date.today()}"
+
+
+def cached_call(timeout=FIGURE_TIMEOUT):
+    """Cache what a function (e.g. a Dash callback building figures) returns for its arguments."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return get_or_build(call_key(function, args, kwargs), lambda: function(*args, **kwargs), timeout)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,181 @@
+"""Profiling of single requests for staff users.
+
+A request is profiled with cProfile if a staff user sends the header
+``X-Profile: 1`` or adds ``?profile=1``. The query flag also keeps
+profiling the following requests of the session for ``SESSION_SECONDS``,
+so opening ``/klimadaten/?profile=1`` profiles the Dash callbacks of the
+clicks on that page as well. ``?profile=0`` stops it.
+
+Every profile is saved as ``.prof`` file (readable with ``pstats`` or
+snakeviz) in the profile directory and listed as ``ProfileRecord`` in the
+admin, with the time spent in pandas, Plotly and the other packages. The
+oldest files are removed when the directory grows over ``MAX_BYTES`` or
+``MAX_FILES``.
+"""
+import cProfile
+import functools
+import io
+import pstats
+import time
+import uuid
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.urls import reverse
+
+from klimadaten.models import ProfileRecord
+
+_settings = getattr(settings, "KLIMADATEN_PROFILING", {})
+MAX_BYTES = _settings.get("MAX_BYTES", 100 * 1024 * 1024)
+MAX_FILES = _settings.get("MAX_FILES", 500)
+SESSION_SECONDS = _settings.get("SESSION_SECONDS", 10 * 60)
+
+SESSION_KEY = "klimadaten_profile_until"
+TOP_FUNCTIONS = 30
+
+# Callbacks run during the profiled request, see profiled_callback
+_callbacks = ContextVar("profiled_callbacks", default=None)
+
+
+def profile_dir():
+    return Path(_settings.get("DIR", settings.BASE_DIR / "klimadaten" / "data" / "profiles"))
+
+
+def wants_profile(request):
+    user = getattr(request, "user", None)
+    if user is None or not user.is_staff or request.path.startswith(reverse("admin:index")):
+        return False
+    flag = request.GET.get("profile")
+    if flag is not None:
+        if flag == "1":
+            request.session[SESSION_KEY] = time.time() + SESSION_SECONDS
+        else:
+            request.session.pop(SESSION_KEY, None)
+    return (
+        request.headers.get("X-Profile") == "1"
+        or flag == "1"
+        or request.session.get(SESSION_KEY, 0) > time.time()
+    )
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not wants_profile(request):
+            return self.get_response(request)
+
+        callbacks = []
+        token = _callbacks.set(callbacks)
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+            _callbacks.reset(token)
+        record = save(profiler, request, response, time.perf_counter() - started, callbacks)
+        response["X-Profile-Id"] = str(record.pk)
+        return response
+
+
+def profiled_callback(function):
+    """Name a Dash callback and its own duration in the profile of the request running it."""
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        callbacks = _callbacks.get()
+        if callbacks is None:
+            return function(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            callbacks.append({"name": function.__name__, "ms": (time.perf_counter() - started) * 1000})
+
+    return wrapper
+
+
+def package(filename):
+    """The top-level package a profiled function belongs to."""
+    if filename == "~":
+        return "builtins"  # C functions, e.g. NumPy ufuncs, count for the package calling them
+    path = filename.replace("\\", "/")
+    if "/site-packages/" in path:
+        return path.split("/site-packages/", 1)[1].split("/", 1)[0].removesuffix(".py")
+    if "/klimadaten/" in path:
+        return "klimadaten"
+    return "python"
+
+
+def breakdown(stats):
+    """Milliseconds spent in every package.
+
+    ``self`` only counts the functions of the package itself. ``total``
+    also counts what they call, it is summed over the calls entering the
+    package from outside. A package entered again through another one (e.g.
+    requests_cache -> requests -> requests_cache) is counted twice there.
+    """
+    own, total = {}, {}
+    for (filename, _, _), (_, _, self_time, _, callers) in stats.stats.items():
+        name = package(filename)
+        own[name] = own.get(name, 0) + self_time * 1000
+        for (caller_filename, _, _), (_, _, _, cumulative_time) in callers.items():
+            if package(caller_filename) != name:
+                total[name] = total.get(name, 0) + cumulative_time * 1000
+    return {
+        "self": dict(sorted(own.items(), key=lambda item: -item[1])),
+        "total": dict(sorted(total.items(), key=lambda item: -item[1])),
+    }
+
+
+def save(profiler, request, response, seconds, callbacks):
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.prof"
+    profiler.dump_stats(directory / name)
+
+    stats = pstats.Stats(profiler)
+    top = io.StringIO()
+    stats.stream = top
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+
+    if callbacks:
+        label = ", ".join(callback["name"] for callback in callbacks)
+    elif request.resolver_match:
+        label = request.resolver_match.view_name
+    else:
+        label = ""
+    record = ProfileRecord.objects.create(
+        user=request.user,
+        method=request.method,
+        path=request.get_full_path()[:500],
+        label=label[:200],
+        status=response.status_code,
+        duration_ms=seconds * 1000,
+        breakdown={**breakdown(stats), "callbacks": callbacks},
+        top_functions=top.getvalue(),
+        file=name,
+        size=(directory / name).stat().st_size,
+    )
+    prune()
+    return record
+
+
+def prune():
+    """Remove the oldest profiles until the directory is within ``MAX_BYTES`` and ``MAX_FILES``."""
+    files = sorted(profile_dir().glob("*.prof"), key=lambda path: path.stat().st_mtime)
+    sizes = [path.stat().st_size for path in files]
+    total = sum(sizes)
+    removed = []
+    for path, size in zip(files, sizes):
+        if total <= MAX_BYTES and len(files) - len(removed) <= MAX_FILES:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        removed.append(path.name)
+    if removed:
+        ProfileRecord.objects.filter(file__in=removed).delete()
@@ -0,0 +1,172 @@
+"""Local on-disk store of daily series per city.
+
+Every city has a fixed size array per variable with one value per day
+since ``SERIES_START`` (typed as in ``openmeteo.DAILY_VARIABLES``) and a
+uint8 array that marks the days fetched from Open-Meteo. All variables share
+this day index and are fetched with one request. The arrays are
+memory-mapped, so reading a date range only touches that part of the files::
+
+    wind_gusts_10m_max/1756121125.npy
+    wind_gusts_10m_max/1756121125.fetched.npy
+    temperature_2m_max/1756121125.npy
+    ...
+"""
+import os
+import threading
+from datetime import date, timedelta
+from pathlib import Path
+
+from django.conf import settings
+import numpy as np
+import pandas as pd
+
+from klimadaten import openmeteo
+
+SERIES_START = date(1940, 1, 1)
+SERIES_END = date(2040, 12, 31)
+CAPACITY_DAYS = (SERIES_END - SERIES_START).days + 1
+
+# The archive lags a few days behind today
+ARCHIVE_DELAY_DAYS = 10
+# Whole series take the archive longer than the ranges of the dashboard
+FETCH_DEADLINE = 60
+
+_write_lock = threading.Lock()
+
+
+def store_dir():
+    return Path(
+        getattr(
+            settings,
+            "KLIMADATEN_SERIES_STORE",
+            settings.BASE_DIR / "klimadaten" / "data" / "series",
+        )
+    )
+
+
+def series_paths(city_id, variable=openmeteo.DAILY_VARIABLE):
+    variable_dir = store_dir() / variable
+    return variable_dir / f"{city_id}.npy", variable_dir / f"{city_id}.fetched.npy"
+
+
+def day_index(day):
+    return (day - SERIES_START).days
+
+
+def last_available_day():
+    return date.today() - timedelta(days=ARCHIVE_DELAY_DAYS)
+
+
+def clip_range(start, end):
+    return max(start, SERIES_START), min(end, last_available_day(), SERIES_END)
+
+
+def open_series(city_id, variable=openmeteo.DAILY_VARIABLE, mode="r"):
+    """Memory-map the values and fetched flags of a city, ``None`` if nothing is stored."""
+    values_path, fetched_path = series_paths(city_id, variable)
+    if not values_path.exists():
+        if mode == "r":
+            return None
+        values_path.parent.mkdir(parents=True, exist_ok=True)
+        # The flags first, readers only look for the values file
+        create_array(fetched_path, np.uint8, 0)
+        create_array(values_path, openmeteo.DAILY_VARIABLES.get(variable, np.float32), np.nan)
+    return np.load(values_path, mmap_mode=mode), np.load(fetched_path, mmap_mode=mode)
+
+
+def create_array(path, dtype, fill):
+    """Create the array file at ``path`` unless another thread or process was first."""
+    tmp_path = path.with_name(f".{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp.npy")
+    array = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(CAPACITY_DAYS,))
+    array[:] = fill
+    array.flush()
+    del array
+    try:
+        # Unlike os.replace, a hard link never overwrites a series another worker is already writing to
+        os.link(tmp_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp_path)
+
+
+def missing_range(city_id, start, end, variable=openmeteo.DAILY_VARIABLE):
+    """Return the smallest ``(start, end)`` covering all days not fetched yet, or ``None``."""
+    start, end = clip_range(start, end)
+    if start > end:
+        return None
+    series = open_series(city_id, variable)
+    if series is None:
+        return start, end
+    fetched = series[1][day_index(start):day_index(end) + 1]
+    missing = np.flatnonzero(fetched == 0)
+    if not len(missing):
+        return None
+    return start + timedelta(days=int(missing[0])), start + timedelta(days=int(missing[-1]))
+
+
+def write_series(city_id, start, values, variable=openmeteo.DAILY_VARIABLE):
+    """Store fetched daily values, the first value belongs to the day ``start``."""
+    # Open-Meteo returns one value per local day starting with the requested start date.
+    # Its UTC timestamps carry a fixed offset, so they are not used to place the values.
+    first = day_index(start)
+    with _write_lock:
+        series_values, fetched = open_series(city_id, variable, mode="r+")
+        values = np.asarray(values, dtype=series_values.dtype)[:CAPACITY_DAYS - first]
+        series_values[first:first + len(values)] = values
+        fetched[first:first + len(values)] = 1
+        series_values.flush()
+        fetched.flush()
+
+
+def ensure_series(city, start, end, variables=tuple(openmeteo.DAILY_VARIABLES)):
+    """Fetch the days between ``start`` and ``end`` that are not stored yet with one upstream call.
+
+    All ``variables`` come with the same call, each is stored in a series of its own.
+    """
+    ranges = [r for r in (missing_range(city.id, start, end, variable) for variable in variables) if r]
+    if not ranges:
+        return False
+    first, last = min(r[0] for r in ranges), max(r[1] for r in ranges)
+    _, columns = openmeteo.fetch_daily(
+        {"lat": city.lat, "lon": city.lon}, first.isoformat(), last.isoformat(), variables, deadline=FETCH_DEADLINE
+    )
+    for variable, values in columns.items():
+        write_series(city.id, first, values, variable)
+    return True
+
+
+def read_series(city_id, start, end, variable=openmeteo.DAILY_VARIABLE):
+    """Return ``(days, values)`` between ``start`` and ``end``, days not stored are NaN."""
+    start, end = clip_range(start, end)
+    days = pd.date_range(start, end, freq="D")
+    series = open_series(city_id, variable)
+    if series is None or start > end:
+        return days, np.full(len(days), np.nan, dtype=np.float32)
+    return days, np.array(series[0][day_index(start):day_index(end) + 1])
+
+
+def read_block(city_ids, start, end, variable=openmeteo.DAILY_VARIABLE):
+    """Stack the values of ``city_ids`` between ``start`` and ``end`` into one array, missing days are NaN."""
+    first, last = day_index(start), day_index(end) + 1
+    block = np.full((len(city_ids), last - first), np.nan, dtype=np.float32)
+    for row, city_id in enumerate(city_ids):
+        series = open_series(city_id, variable)
+        if series is None:
+            continue
+        values, fetched = series
+        block[row] = np.where(fetched[first:last] == 1, values[first:last], np.nan)
+    return block
+
+
+def stored_city_ids(variable=openmeteo.DAILY_VARIABLE):
+    return sorted(int(path.stem) for path in (store_dir() / variable).glob("*.npy") if path.stem.isdigit())
+
+
+def iter_chunks(city_id, start, end, chunk_days=366, variable=openmeteo.DAILY_VARIABLE):
+    """Yield ``(days, values)`` blocks so long ranges never have to be held in memory at once."""
+    start, end = clip_range(start, end)
+    while start <= end:
+        chunk_end = min(start + timedelta(days=chunk_days - 1), end)
+        yield read_series(city_id, start, chunk_end, variable)
+        start = chunk_end + timedelta(days=1)
@@ -0,0 +1,96 @@
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from cdk1_2Da.routers import use_primary
+from klimadaten import aggregates, neighbours, profiling
+from klimadaten.models import City, ProfileRecord, Station, TableVersion
+
+_state = threading.local()
+
+# Work that is done once at the end of a bulk load instead of per row
+BULK_REFRESH = {
+    "city": [neighbours.rebuild_all],
+    "station": [aggregates.refresh_all, neighbours.rebuild_all],
+}
+
+
+def bulk_loading():
+    return getattr(_state, "bulk_tables", set())
+
+
+@contextmanager
+def bulk_load(*tables):
+    """Skip the per-row signal work for ``tables`` and do it once at the end.
+
+    Used by the loader commands which save thousands of rows in a row.
+    """
+    previous = bulk_loading()
+    _state.bulk_tables = previous | set(tables)
+    # Loaders read what they have just written, replicas may lag behind
+    with use_primary():
+        try:
+            yield
+        finally:
+            _state.bulk_tables = previous
+            for table in tables:
+                for refresh in BULK_REFRESH.get(table, []):
+                    refresh()
+                TableVersion.bump(table)
+
+
+@receiver(post_save, sender=City)
+def city_saved(sender, instance, **kwargs):
+    if "city" not in bulk_loading():
+        with use_primary():
+            neighbours.refresh_cities([instance.id])
+        TableVersion.bump("city")
+
+
+@receiver(post_delete, sender=City)
+def city_deleted(sender, **kwargs):
+    # The links of the city are removed by the cascade
+    if "city" not in bulk_loading():
+        TableVersion.bump("city")
+
+
+@receiver(pre_save, sender=Station)
+def station_saving(sender, instance, **kwargs):
+    # Remember the old country, a station moved to another country changes both aggregates
+    if "station" in bulk_loading():
+        instance._previous_country = None
+        return
+    with use_primary():
+        instance._previous_country = Station.objects.filter(pk=instance.pk).values_list("country", flat=True).first()
+
+
+@receiver(pre_delete, sender=Station)
+def station_deleting(sender, instance, **kwargs):
+    # The links are gone after the delete, remember which cities need new neighbours
+    if "station" not in bulk_loading():
+        with use_primary():
+            instance._linked_cities = list(instance.city_links.values_list("city_id", flat=True))
+
+
+@receiver([post_save, post_delete], sender=Station)
+def station_changed(sender, instance, **kwargs):
+    if "station" in bulk_loading():
+        return
+    with use_primary():
+        aggregates.refresh_country(instance.country)
+        previous_country = getattr(instance, "_previous_country", None)
+        if previous_country and previous_country != instance.country:
+            aggregates.refresh_country(previous_country)
+
+        if kwargs["signal"] is post_delete:
+            neighbours.refresh_cities(getattr(instance, "_linked_cities", []))
+        else:
+            neighbours.refresh_cities(neighbours.cities_affected_by(instance))
+    TableVersion.bump("station")
+
+
+@receiver(post_delete, sender=ProfileRecord)
+def profile_deleted(sender, instance, **kwargs):
+    (profiling.profile_dir() / instance.file).unlink(missing_ok=True)
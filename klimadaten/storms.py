@@ -0,0 +1,156 @@
+"""Detection of storms in the stored city series.
+
+A city takes part in a storm on a day if its gust reaches ``THRESHOLD_KMH``
+(Beaufort 9) and at least ``MIN_NEIGHBOURS`` cities within ``RADIUS_KM`` do
+so on the same or the previous day. The neighbours come from a KD-tree over
+the cities, stored as sparse matrix, so the support of all cities and days
+of a block is one sparse matrix product over a rolling window.
+
+On every day the taking part cities are split into connected groups, groups
+with at least ``MIN_CITIES`` cities are storm cells. A cell continues the
+event of a cell that touched the same area on one of the previous
+``MAX_GAP_DAYS + 1`` days, i.e. with at most ``MAX_GAP_DAYS`` quiet days in
+between, otherwise it starts a new event.
+"""
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+from klimadaten import openmeteo, series_store
+from klimadaten.models import City
+from klimadaten.neighbours import EARTH_RADIUS_KM, unit_vectors
+
+THRESHOLD_KMH = 75  # Beaufort 9, "Sturm"
+RADIUS_KM = 100
+MIN_NEIGHBOURS = 2
+MIN_CITIES = 5
+WINDOW_DAYS = 2  # a storm passing at midnight reaches its neighbours a day later
+MAX_GAP_DAYS = 1  # quiet days within one storm
+
+
+@dataclass
+class Event:
+    start: object
+    end: object
+    cities: set = field(default_factory=set)
+    peak_gust: float = -np.inf
+    peak_day: object = None
+    peak_city: int = None
+    lat: float = None  # centroid of the footprint
+    lon: float = None
+
+    def add(self, day, rows, gusts, city_ids):
+        self.end = max(self.end, day)
+        self.cities.update(rows.tolist())
+        strongest = int(np.argmax(gusts))
+        if gusts[strongest] > self.peak_gust:
+            self.peak_gust = float(gusts[strongest])
+            self.peak_day = day
+            self.peak_city = int(city_ids[rows[strongest]])
+
+    def merge(self, other):
+        self.start = min(self.start, other.start)
+        self.end = max(self.end, other.end)
+        self.cities |= other.cities
+        if other.peak_gust > self.peak_gust:
+            self.peak_gust, self.peak_day, self.peak_city = other.peak_gust, other.peak_day, other.peak_city
+
+
+def neighbour_matrix(lat, lon, radius_km=RADIUS_KM):
+    """Sparse ``(cities, cities)`` matrix with a 1 for every pair closer than ``radius_km``."""
+    points = unit_vectors(lat, lon)
+    chord = 2 * np.sin(radius_km / EARTH_RADIUS_KM / 2)
+    pairs = cKDTree(points).query_pairs(chord, output_type="ndarray")
+    rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    columns = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=(len(lat),) * 2)
+
+
+def storm_cells(block, previous, neighbours, threshold=THRESHOLD_KMH, min_neighbours=MIN_NEIGHBOURS):
+    """Mark the cities and days of ``block`` that take part in a storm.
+
+    ``previous`` holds the last ``WINDOW_DAYS - 1`` days before the block.
+    """
+    exceeding = np.concatenate([previous, block], axis=1) >= threshold
+    # Cities above the threshold on the day itself or the days before
+    recent = sliding_window_view(exceeding, WINDOW_DAYS, axis=1).any(axis=-1)
+    support = neighbours @ recent.astype(np.float32)
+    return exceeding[:, WINDOW_DAYS - 1:] & (support >= min_neighbours)
+
+
+def detect(
+    start,
+    end,
+    variable=openmeteo.DAILY_VARIABLE,
+    threshold=THRESHOLD_KMH,
+    radius_km=RADIUS_KM,
+    min_cities=MIN_CITIES,
+    chunk_days=366,
+):
+    """Return the storm events between ``start`` and ``end`` and the ids of the scanned cities."""
+    cities = list(City.objects.filter(id__in=series_store.stored_city_ids(variable)).values_list("id", "lat", "lon"))
+    city_ids = np.array([city[0] for city in cities], dtype=np.int64)
+    lat = np.array([float(city[1]) for city in cities])
+    lon = np.array([float(city[2]) for city in cities])
+    if not len(city_ids):
+        return [], city_ids
+    neighbours = neighbour_matrix(lat, lon, radius_km)
+    touching = neighbours + sparse.identity(len(city_ids), format="csr", dtype=np.float32)
+
+    events = []
+    parent = []  # union-find over the events, merged events point to the surviving one
+    last_day = np.full(len(city_ids), -MAX_GAP_DAYS - 2, dtype=np.int64)
+    last_event = np.full(len(city_ids), -1, dtype=np.int64)
+
+    def root(event):
+        while parent[event] != event:
+            parent[event] = parent[parent[event]]
+            event = parent[event]
+        return event
+
+    previous = np.full((len(city_ids), WINDOW_DAYS - 1), np.nan, dtype=np.float32)
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end)
+        block = series_store.read_block(city_ids, chunk_start, chunk_end, variable)
+        cells = storm_cells(block, previous, neighbours, threshold)
+        previous = block[:, block.shape[1] - (WINDOW_DAYS - 1):]
+
+        for column in np.flatnonzero(cells.sum(axis=0) >= min_cities):
+            day = chunk_start + timedelta(days=int(column))
+            day_number = (day - start).days
+            rows = np.flatnonzero(cells[:, column])
+            count, labels = connected_components(neighbours[rows][:, rows], directed=False)
+            for label in range(count):
+                cell = rows[labels == label]
+                if len(cell) < min_cities:
+                    continue
+                # Events that touched this area recently
+                area = np.unique(touching[cell].indices)
+                recent = area[last_day[area] >= day_number - 1 - MAX_GAP_DAYS]
+                candidates = {root(int(event)) for event in last_event[recent]}
+                if candidates:
+                    event = min(candidates)
+                    for other in candidates - {event}:
+                        parent[other] = event
+                        events[event].merge(events[other])
+                        events[other] = None
+                else:
+                    event = len(events)
+                    events.append(Event(start=day, end=day))
+                    parent.append(event)
+                events[event].add(day, cell, block[cell, column], city_ids)
+                last_day[cell] = day_number
+                last_event[cell] = event
+        chunk_start = chunk_end + timedelta(days=1)
+
+    found = [event for event in events if event is not None]
+    for event in found:
+        rows = np.fromiter(event.cities, dtype=np.int64)
+        event.lat, event.lon = float(lat[rows].mean()), float(lon[rows].mean())
+    return found, city_ids
@@ -1,3 +1,387 @@
-from django.test import TestCase
+import gzip
+import json
+import tempfile
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from scipy import integrate, optimize, stats
+
+from klimadaten import climatology, country_series, openmeteo, series_store, storms, views
+from klimadaten.array_cache import ArrayCache
+from klimadaten.circuit_breaker import CircuitBreaker, CircuitOpen
+from klimadaten.forms import ExportForm
+from klimadaten.models import City, TableVersion
+
+
+class ArrayCacheTests(SimpleTestCase):
+    def arrays(self, n):
+        return (np.zeros(n, dtype=np.float32),)
+
+    def test_evicts_least_recently_used_over_the_byte_budget(self):
+        cache = ArrayCache(max_bytes=3 * 400)
+        for key in "abc":
+            cache.set(key, self.arrays(100))
+        cache.get("a")
+        cache.set("d", self.arrays(100))
+
+        self.assertIsNone(cache.get("b"))
+        for key in "acd":
+            self.assertIsNotNone(cache.get(key))
+        info = cache.cache_info()
+        self.assertEqual(info.evictions, 1)
+        self.assertEqual(info.entries, 3)
+        self.assertEqual(info.currbytes, 3 * 400)
+
+    def test_replacing_a_key_keeps_the_byte_count(self):
+        cache = ArrayCache(max_bytes=1000)
+        cache.set("a", self.arrays(100))
+        cache.set("a", self.arrays(50))
+        self.assertEqual(cache.cache_info().currbytes, 200)
+
+    def test_entry_larger_than_the_budget_is_not_stored(self):
+        cache = ArrayCache(max_bytes=400)
+        cache.set("a", self.arrays(100))
+        cache.set("big", self.arrays(101))
+        self.assertIsNone(cache.get("big"))
+        self.assertIsNotNone(cache.get("a"))
+
+    def test_arrays_are_read_only(self):
+        cache = ArrayCache(max_bytes=1000)
+        cache.set("a", self.arrays(10))
+        (values,) = cache.get("a")
+        with self.assertRaises(ValueError):
+            values[0] = 1
+
+    @mock.patch("klimadaten.array_cache.time.monotonic")
+    def test_entries_expire_after_the_ttl(self, monotonic):
+        monotonic.return_value = 100.0
+        cache = ArrayCache(max_bytes=1000, ttl=60)
+        cache.set("default", self.arrays(10))
+        cache.set("short", self.arrays(10), ttl=5)
+
+        monotonic.return_value = 104.0
+        self.assertIsNotNone(cache.get("short"))
+        monotonic.return_value = 105.0
+        self.assertIsNone(cache.get("short"))
+        self.assertIsNotNone(cache.get("default"))
+        monotonic.return_value = 160.0
+        self.assertIsNone(cache.get("default"))
+
+        info = cache.cache_info()
+        self.assertEqual((info.expired, info.entries, info.currbytes), (2, 0, 0))
+
+
+@mock.patch("klimadaten.circuit_breaker.time.monotonic", return_value=100.0)
+class CircuitBreakerTests(SimpleTestCase):
+    def open_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.failure()
+        breaker.failure()
+        return breaker
+
+    def test_opens_after_the_threshold_of_failures_in_a_row(self, monotonic):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.before_call()
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpen):
+            breaker.before_call()
+
+    def test_lets_a_single_trial_call_through_when_half_open(self, monotonic):
+        breaker = self.open_breaker()
+        monotonic.return_value = 130.0
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.before_call()
+        with self.assertRaises(CircuitOpen):
+            breaker.before_call()
+
+    def test_successful_trial_closes(self, monotonic):
+        breaker = self.open_breaker()
+        monotonic.return_value = 130.0
+        breaker.before_call()
+        breaker.success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.before_call()
+
+    def test_failed_trial_opens_again(self, monotonic):
+        breaker = self.open_breaker()
+        monotonic.return_value = 130.0
+        breaker.before_call()
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        monotonic.return_value = 159.0
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        monotonic.return_value = 160.0
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+
+    def test_request_archive_sends_nothing_while_open(self, monotonic):
+        with mock.patch.object(openmeteo, "breaker", self.open_breaker()), \
+                mock.patch.object(openmeteo, "cache_session") as cache_session:
+            with self.assertRaises(openmeteo.UpstreamUnavailable):
+                openmeteo.request_archive({}, deadline=1)
+        cache_session.assert_not_called()
+
+
+class ClimatologyTests(SimpleTestCase):
+    def maxima(self):
+        rng = np.random.default_rng(1)
+        maxima = stats.genextreme.rvs(-0.1, loc=90, scale=12, size=(3, 60), random_state=rng)
+        maxima[1, ::4] = np.nan
+        maxima[2, 8:] = np.nan
+        return maxima
+
+    def test_l_moments_match_scipy_and_ignore_nan(self):
+        maxima = self.maxima()
+        l1, l2, t3, n = climatology.l_moments(maxima)
+        for row, values in enumerate(maxima):
+            values = values[np.isfinite(values)]
+            expected = stats.lmoment(values, order=[1, 2, 3], standardize=True)
+            np.testing.assert_allclose([l1[row], l2[row], t3[row]], expected, rtol=1e-10)
+            self.assertEqual(n[row], len(values))
+
+    def test_return_levels_are_the_quantiles_of_the_fitted_distributions(self):
+        maxima = self.maxima()
+        l1, l2, t3, _ = climatology.l_moments(maxima)
+        probabilities = 1 - 1 / np.asarray(climatology.RETURN_PERIODS)
+
+        scale = l2[0] / np.log(2)
+        expected = stats.gumbel_r.ppf(probabilities, loc=l1[0] - np.euler_gamma * scale, scale=scale)
+        np.testing.assert_allclose(climatology.gumbel_levels(l1, l2)[0], expected, rtol=1e-10)
+
+        # Solve the L-moment equations of the GEV numerically instead of Hosking's approximation
+        def distribution_l_moments(k):
+            quantile = stats.genextreme(k).ppf
+            return [
+                integrate.quad(lambda p: quantile(p) * weight(p), 0, 1)[0]
+                for weight in (lambda p: 1, lambda p: 2 * p - 1, lambda p: 6 * p**2 - 6 * p + 1)
+            ]
+
+        def l_skewness(k):
+            _, lambda2, lambda3 = distribution_l_moments(k)
+            return lambda3 / lambda2
+
+        k = optimize.brentq(lambda k: l_skewness(k) - t3[0], -0.5, 0.5)
+        standard_l1, standard_l2, _ = distribution_l_moments(k)
+        gev_scale = l2[0] / standard_l2
+        fitted = stats.genextreme(k, loc=l1[0] - gev_scale * standard_l1, scale=gev_scale)
+        np.testing.assert_allclose(climatology.gev_levels(l1, l2, t3)[0], fitted.ppf(probabilities), rtol=1e-3)
+
+    def test_no_fit_with_too_few_years(self):
+        levels, n = climatology.return_levels(self.maxima())
+        self.assertEqual(n.tolist(), [60, 45, 8])
+        self.assertTrue(np.isfinite(levels[:2]).all())
+        self.assertTrue(np.isnan(levels[2]).all())
+
+    def test_annual_maxima_skip_years_with_missing_days(self):
+        _, year_starts, year_lengths = climatology.calendar(2019, 2020)
+        self.assertEqual(year_lengths.tolist(), [365, 366])
+        block = np.arange(731, dtype=np.float32)[None, :].repeat(2, axis=0)
+        block[1, 400:450] = np.nan
+        maxima = climatology.annual_maxima(block, year_starts, year_lengths)
+        np.testing.assert_array_equal(maxima[0], [364, 730])
+        self.assertEqual(maxima[1, 0], 364)
+        self.assertTrue(np.isnan(maxima[1, 1]))
+
+
+class CountrySeriesTests(SimpleTestCase):
+    def test_exceedance_counts_values_strictly_over_each_bound(self):
+        bounds = country_series.BEAUFORT_KMH
+        # Two countries, rows 0-2 and 3-4, every bound, just above it and missing values
+        block = np.array(
+            [
+                [0, 0.5, 75, 75.01, np.nan, 200],
+                [np.nan, 1, 6, 118, 118.5, 12],
+                [20, 29.5, np.nan, 62, 61.9, 0],
+                [np.nan, np.nan, np.nan, np.nan, np.nan, np.nan],
+                [103, 103.1, 89, 39, 50, 1.1],
+            ],
+            dtype=np.float32,
+        )
+        starts = np.array([0, 3])
+        cities, mean, maximum, exceeding = country_series.aggregate_block(block, starts)
+
+        for country, rows in enumerate((slice(0, 3), slice(3, 5))):
+            for level, bound in enumerate(bounds):
+                expected = (np.nan_to_num(block[rows], nan=-1) > bound).sum(axis=0)
+                np.testing.assert_array_equal(exceeding[country, level], expected, err_msg=f"level {level}")
+            np.testing.assert_array_equal(cities[country], np.isfinite(block[rows]).sum(axis=0))
+        np.testing.assert_allclose(mean[0], np.nanmean(block[:3], axis=0))
+        np.testing.assert_array_equal(maximum[0], np.nanmax(block[:3], axis=0))
+        # A city without values does not change the mean of its country
+        np.testing.assert_array_equal(mean[1], block[4])
+        # 75 km/h is not over the Sturm bound, 75.01 and 118 are
+        self.assertEqual(exceeding[0, 9, 2], 0)
+        self.assertEqual(exceeding[0, 9, 3], 2)
+
+
+class TemporarySeriesStoreMixin:
+    def setUp(self):
+        super().setUp()
+        store = tempfile.TemporaryDirectory()
+        self.addCleanup(store.cleanup)
+        settings = override_settings(KLIMADATEN_SERIES_STORE=store.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+
+class StormTests(TemporarySeriesStoreMixin, TestCase):
+    # Two groups of six cities about 120 km apart and a group in between, within 100 km of both
+    GROUPS = {"west": 8.0, "middle": 8.8, "east": 9.6}
+    START = date(2000, 1, 1)
+    DAYS = 12
+
+    def setUp(self):
+        super().setUp()
+        cities = []
+        self.ids = {}
+        for group, lon in self.GROUPS.items():
+            self.ids[group] = []
+            for i in range(6):
+                city_id = 1000 + len(cities)
+                cities.append(City(
+                    id=city_id, name=f"{group} {i}", country="Schweiz", iso2="CH", iso3="CHE",
+                    lat=47 + 0.05 * i, lon=lon + 0.02 * i,
+                ))
+                self.ids[group].append(city_id)
+        City.objects.bulk_create(cities)
+        self.gusts = {city.id: np.full(self.DAYS, 30, dtype=np.float32) for city in cities}
+
+    def storm(self, group, *days, gust=80):
+        for city_id in self.ids[group]:
+            self.gusts[city_id][list(days)] = gust
+
+    def detect(self, chunk_days=366):
+        for city_id, gusts in self.gusts.items():
+            series_store.write_series(city_id, self.START, gusts)
+        end = self.START + timedelta(days=self.DAYS - 1)
+        events, _ = storms.detect(self.START, end, chunk_days=chunk_days)
+        return sorted(events, key=lambda event: event.start)
+
+    def day(self, number):
+        return self.START + timedelta(days=number)
+
+    def test_one_quiet_day_continues_the_event_two_start_a_new_one(self):
+        self.storm("west", 1, 3)
+        self.storm("west", 6)
+        for chunk_days in (366, 2):
+            events = self.detect(chunk_days)
+            self.assertEqual([(e.start, e.end) for e in events], [(self.day(1), self.day(3)), (self.day(6), self.day(6))])
+
+    def test_separate_cells_merge_when_a_storm_connects_them(self):
+        self.storm("west", 2, 3)
+        self.storm("east", 2, 3)
+        self.storm("middle", 3)
+        self.gusts[self.ids["east"][4]][2] = 95
+
+        (event,) = self.detect(chunk_days=3)
+        self.assertEqual((event.start, event.end), (self.day(2), self.day(3)))
+        self.assertEqual(len(event.cities), 18)
+        self.assertEqual((event.peak_gust, event.peak_day, event.peak_city), (95, self.day(2), self.ids["east"][4]))
+
+    def test_cells_below_the_minimum_are_no_storm(self):
+        self.storm("west", 4)
+        self.gusts[self.ids["west"][0]][4] = 30
+        self.gusts[self.ids["west"][1]][4] = 30
+        self.assertEqual(self.detect(), [])
+
+
+class ExportTests(TemporarySeriesStoreMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        City.objects.bulk_create([
+            City(id=city_id, name=f"Ort {city_id}", country="Schweiz", iso2="CH", iso3="CHE", lat=47, lon=8)
+            for city_id in range(1, ExportForm.MAX_CITIES + 2)
+        ])
+
+    def export(self, **params):
+        params = {"city": [1], "start": "2000-01-01", "end": "2000-01-03", **params}
+        return self.client.get(reverse("export_series"), params)
+
+    def test_invalid_requests_are_rejected(self):
+        for params in (
+            {"city": [999]},
+            {"start": "2000-02-01"},
+            {"city": list(range(1, ExportForm.MAX_CITIES + 2))},
+            {"format": "xlsx"},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.export(**params).status_code, 400)
+
+    def test_upstream_errors_are_reported_before_streaming(self):
+        for error, status in (
+            (openmeteo.UpstreamUnavailable("down"), 503),
+            (openmeteo.OpenMeteoError("bad"), 502),
+        ):
+            with self.subTest(status=status), mock.patch.object(openmeteo, "fetch_daily", side_effect=error):
+                response = self.export()
+                self.assertEqual(response.status_code, status)
+                self.assertFalse(response.streaming)
+
+    def test_stored_series_are_exported_without_upstream_calls(self):
+        series_store.write_series(1, date(2000, 1, 1), [80, np.nan, 90])
+        with mock.patch.object(openmeteo, "fetch_daily") as fetch_daily:
+            response = self.export()
+        fetch_daily.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], ",".join(views.EXPORT_COLUMNS))
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[1].startswith("1,Ort 1,Schweiz,2000-01-01,80"))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class PointsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        City.objects.bulk_create([
+            City(id=1, name="Brugg", country="Switzerland", iso2="CH", iso3="CHE", lat=47.48, lon=8.21),
+            City(id=2, name="Sumba", country="Faroe Islands", iso2="FO", iso3="FRO", lat=61.41, lon=-6.71),
+        ])
+
+    def get(self, query="", **headers):
+        return self.client.get(f"{reverse('points', args=['cities'])}{query}", headers=headers)
+
+    def test_unchanged_point_set_is_not_sent_again(self):
+        response = self.get("?country=switzerland")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["name"], ["Brugg"])
+        self.assertIn("public", response["Cache-Control"])
+
+        revalidated = self.get("?country=switzerland", If_None_Match=response["ETag"])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.content, b"")
+
+        # Other filters and a changed table are other representations
+        self.assertEqual(self.get("?country=faroe%20islands", If_None_Match=response["ETag"]).status_code, 200)
+        TableVersion.bump("city")
+        changed = self.get("?country=switzerland", If_None_Match=response["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], response["ETag"])
+
+    def test_encoding_is_part_of_the_etag(self):
+        plain = self.get()
+        compressed = self.get(Accept_Encoding="gzip;q=0.8, identity;q=0.5")
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", compressed["Vary"])
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertNotEqual(compressed["ETag"], plain["ETag"])
+        self.assertEqual(self.get(If_None_Match=compressed["ETag"]).status_code, 200)
+        self.assertEqual(self.get(Accept_Encoding="gzip;q=0, br;q=0").get("Content-Encoding"), None)
+
+    def test_errors_are_not_cacheable(self):
+        for response, status in (
+            (self.get("?bbox=9,0,8,1"), 400),
+            (self.client.get(reverse("points", args=["rivers"])), 404),
+        ):
+            with self.subTest(status=status):
+                self.assertEqual(response.status_code, status)
+                self.assertFalse(response.has_header("ETag"))
+                self.assertFalse(response.has_header("Cache-Control"))
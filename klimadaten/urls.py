@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 from klimadaten.dash_apps.finished_apps import example
 from klimadaten.dash_apps.finished_apps import stations_map
 
@@ -8,4 +8,6 @@ urlpatterns = [
     path("", views.map_stations, name="map_stations"),
     path("example", views.example, name="example"),
     path("Datastory", views.datastory, name="datastory"),
+    path("export", views.export_series, name="export_series"),
+    path("api/points/<str:kind>", api.points, name="points"),
 ]
@@ -1,7 +1,15 @@
-from django.db.models import Count
+import csv
+import functools
+import io
+
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.shortcuts import render
-from klimadaten.models import Station
+from klimadaten import aggregates, figures, openmeteo, series_store
+from klimadaten.forms import CountryForm, ExportForm
+from klimadaten.models import CountryAggregate, Station, TableVersion
+from klimadaten.page_cache import cached_page
 import plotly.express as px
+import plotly.io as pio
 import pandas as pd
 
 EUROPE_NORTH = 71.5  # North Cape in Norway
@@ -10,36 +18,52 @@ EUROPE_WEST = -25  # Iceland
 EUROPE_EAST = 60  # Ural Mountains in Russia
 
 
+# Rendered plots are kept as template fragments, shared by every page that shows them
+FRAGMENT_TIMEOUT = 24 * 60 * 60
+
+
+@cached_page()
 def example(request):
     return render(request, "klimadaten/example.html")
 
 
+@cached_page()
 def map_stations(request):
     return render(request, "klimadaten/map_stations.html")
 
 
+@cached_page("station")
 def stations(request):
-    barplot = country_count_bar()
-    map = get_map()
-    context = {"barplot": barplot, "map": map}
+    form = CountryForm(request.GET or None)
+    country = form.cleaned_data["country"] if form.is_valid() else None
+    # The template calls these only if its fragment cache misses
+    context = {
+        "barplot": country_count_bar,
+        "map": functools.partial(get_map, country),
+        "country": country or "ALL",
+        "station_version": TableVersion.current("station"),
+        "fragment_timeout": FRAGMENT_TIMEOUT,
+        "form": form,
+    }
     return render(request, "klimadaten/stations.html", context)
 
 
+@cached_page()
 def datastory(request):
     return render(request, "klimadaten/Datastory.html")
 
 
 def country_count_bar():
-    stations_per_country = (
-        Station.objects.values("country")
-        .annotate(total=Count("country"))
-        .order_by("-total")
+    stations_per_country = pd.DataFrame.from_records(
+        CountryAggregate.objects.order_by("-station_count").values("country", "station_count"),
+        columns=["country", "station_count"],
     )
     fig = px.bar(
-        x=stations_per_country.values_list("country", flat=True),
-        y=stations_per_country.values_list("total", flat=True),
+        stations_per_country,
+        x="country",
+        y="station_count",
         title="Number of Stations per Country",
-        labels={"x": "Country", "y": "Number of Stations"},
+        labels={"country": "Country", "station_count": "Number of Stations"},
     )
     fig.update_layout(
         title={
@@ -48,32 +72,32 @@ def country_count_bar():
             "x": 0.5,
         }
     )
-    return fig.to_html()
-
-
-def get_map():
-    df = fetch_station_data()
-    fig = px.scatter_mapbox(
-        df,
-        lat="lat",
-        lon="lon",
-        hover_name="name",
-        hover_data=["elevation"],
-        color_continuous_scale=px.colors.sequential.Turbo,
-        zoom=7,
-        # height=300,
+    return fig.to_html(full_html=False, include_plotlyjs=False)
+
+
+def get_map(country=None):
+    df = fetch_station_data(country)
+    if df.empty:
+        df = pd.DataFrame(columns=["name", "lat", "lon", "elevation"])
+    center, zoom = None, None
+    aggregate = CountryAggregate.objects.filter(country=country).first() if country else None
+    if aggregate:
+        # Zoom to the bounding box of the country without scanning its stations
+        center, zoom = aggregates.map_view(aggregate)
+    fig = figures.scatter_map(
+        df["lat"].astype(float),
+        df["lon"].astype(float),
+        hovertext=df["name"],
+        customdata=df["elevation"].astype(float),
+        customdata_dtype="f4",
+        hovertemplate="<b>%{hovertext}</b><br>elevation=%{customdata}<extra></extra>",
+        layout=figures.EUROPE_MAP_LAYOUT,
+        center=center,
+        zoom=zoom,
+        typed=figures.PLOTLY_TYPED_ARRAYS,
     )
-    fig.update_layout(mapbox_style="open-street-map")
-    fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
-    fig.update_layout(
-        mapbox_bounds={
-            "west": EUROPE_WEST,
-            "east": EUROPE_EAST,
-            "south": EUROPE_SOUTH,
-            "north": EUROPE_NORTH,
-        }
-    )
-    return fig.to_html()
+    # The figure dict is built from a prebuilt template, validating it again is not needed
+    return pio.to_html(fig, validate=False, full_html=False, include_plotlyjs=False)
 
 
 def fetch_station_data(country=None):
@@ -87,3 +111,115 @@ def fetch_station_data(country=None):
         # station_data.values("name", "lat", "lon")
     )
     return df
+
+
+def export_series(request):
+    form = ExportForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text(), content_type="text/plain")
+    cities = form.cleaned_data["city"]
+    start = form.cleaned_data["start"]
+    end = form.cleaned_data["end"]
+    filename = f"wind_gusts_{start:%Y%m%d}_{end:%Y%m%d}"
+
+    if form.cleaned_data["format"] == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return HttpResponse("Parquet export requires pyarrow.", status=501, content_type="text/plain")
+
+    # Missing days are fetched into the local store before the status is sent, a failing
+    # archive would otherwise cut off a response that already went out as 200
+    try:
+        for city in cities:
+            series_store.ensure_series(city, start, end, (openmeteo.DAILY_VARIABLE,))
+    except openmeteo.UpstreamUnavailable as e:
+        return HttpResponse(f"Open-Meteo is not available: {e}", status=503, content_type="text/plain")
+    except openmeteo.OpenMeteoError as e:
+        return HttpResponse(f"Open-Meteo failed: {e}", status=502, content_type="text/plain")
+
+    if form.cleaned_data["format"] == "parquet":
+        response = StreamingHttpResponse(
+            stream_parquet(cities, start, end), content_type="application/vnd.apache.parquet"
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename}.parquet"'
+        return response
+
+    response = StreamingHttpResponse(stream_csv(cities, start, end), content_type="text/csv")
+    response["Content-Disposition"] = f'attachment; filename="{filename}.csv"'
+    return response
+
+
+EXPORT_COLUMNS = ["city_id", "city", "country", "date", openmeteo.DAILY_VARIABLE]
+
+
+def export_chunks(cities, start, end):
+    """Yield one DataFrame per city and year from the local store."""
+    for city in cities:
+        for days, values in series_store.iter_chunks(city.id, start, end):
+            yield pd.DataFrame(
+                {
+                    "city_id": city.id,
+                    "city": city.name,
+                    "country": city.country,
+                    "date": days.date,
+                    openmeteo.DAILY_VARIABLE: values,
+                },
+                columns=EXPORT_COLUMNS,
+            )
+
+
+def stream_csv(cities, start, end):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+    for chunk in export_chunks(cities, start, end):
+        yield chunk.to_csv(header=False, index=False, float_format="%.2f")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands out what was written since the last drain."""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+
+def stream_parquet(cities, start, end):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [
+            ("city_id", pa.int64()),
+            ("city", pa.string()),
+            ("country", pa.string()),
+            ("date", pa.date32()),
+            (openmeteo.DAILY_VARIABLE, pa.float32()),
+        ]
+    )
+    sink = _ChunkSink()
+    # Created up front, so an empty range still gives a valid file with the export columns
+    writer = pq.ParquetWriter(sink, schema)
+    for chunk in export_chunks(cities, start, end):
+        # Every year of a city becomes one row group which is sent right away
+        writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
@@ -0,0 +1,74 @@
+"""Warm-up of the in-process caches of a web worker.
+
+The array cache, the city table and the loaded country series and
+climatology live in the memory of each process, so they are filled when a
+worker starts (see ``gunicorn.conf.py``) and not by ``manage.py
+warm_caches``, which only fills the caches shared by all processes.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import pandas as pd
+
+from klimadaten import city_table, climatology, country_series, openmeteo
+from klimadaten.dash_apps.finished_apps import stations_map
+
+logger = logging.getLogger(__name__)
+
+# Sumba and Brugg, the default selections of StationsMap
+DEFAULT_CITIES = [stations_map.INITIAL_CITY_ID, 1756121125]
+DEFAULT_YEAR = 1991
+DEFAULT_MONTH = "04"
+DEFAULT_WINDSPEED = 75
+
+
+def last_year_range():
+    # The same window update_plots asks for
+    today = pd.Timestamp.now().normalize()
+    return (
+        (today - timedelta(days=365 + 10)).strftime("%Y-%m-%d"),
+        (today - timedelta(days=10)).strftime("%Y-%m-%d"),
+    )
+
+
+def dashboard_ranges(year):
+    """All ``(start_date, end_date)`` the StationsMap callbacks request for one city.
+
+    The monthly comparison reads the series store, see the ``series`` tier of warm_caches.
+    """
+    return [last_year_range(), (f"{year}-01-01", f"{year}-12-31")]
+
+
+def warm_process(city_ids=DEFAULT_CITIES, year=DEFAULT_YEAR):
+    """Load what the first dashboard requests of this process would otherwise load."""
+    started = time.perf_counter()
+    cities = city_table.current()
+    country_series.load()
+    climatology.load()
+    missing = 0
+    for city_id in city_ids:
+        for stored_coordinates in (False, True):
+            city = cities.city(city_id, stored_coordinates)
+            if city is None:
+                continue
+            for start, end in dashboard_ranges(year):
+                # Decoded from the HTTP cache filled by warm_caches, no request if it is warm
+                try:
+                    openmeteo.call_open_meteo(city, start, end)
+                except openmeteo.OpenMeteoError:
+                    missing += 1
+    logger.info("Warmed the in-process caches in %.1fs, %d ranges missing", time.perf_counter() - started, missing)
+
+
+def start():
+    """Warm up in the background, the worker serves requests meanwhile."""
+
+    def run():
+        try:
+            warm_process()
+        except Exception:
+            logger.exception("Warming the in-process caches failed")
+
+    threading.Thread(target=run, name="klimadaten-warmup", daemon=True).start()